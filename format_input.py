@@ -1,37 +1,190 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import io
 import os
 import re
+import bz2
+import csv
 import sys
+import gzip
+import html
+import json
+import lzma
 import time
+import queue
 import shutil
+import pickle
+import sqlite3
+import hashlib
+import zipfile
 import argparse
 import tempfile
 import warnings
+import itertools
+import threading
 import traceback
+import tracemalloc
+import collections
+import unicodedata
 import xlsxwriter
+import concurrent.futures
 import numpy as np
 import pandas as pd
 from colorama import init
 from pprint import pprint
 init()
 
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
 def menu():
     parser = argparse.ArgumentParser(description = "This script reads the exported (.csv|.txt) files from Scopus, Web of Science, PubMed, PubMed Central, Dimensions, Cochrane, Embase, ScienceDirect, IEEE, BVS, CAB, SciELO, or Google Scholar (exported from Publish or Perish) databases and turns each of them into a new file with an unique format. This script will ignore duplicated records.", epilog = "Thank you!")
     parser.add_argument("-t", "--type_file", choices = ofi.ARRAY_TYPE, required = True, type = str.lower, help = ofi.mode_information(ofi.ARRAY_TYPE, ofi.ARRAY_DESCRIPTION))
-    parser.add_argument("-i", "--input_file", required = True, help = "Input file .csv or .txt")
+    parser.add_argument("-i", "--input_file", help = "Input file .csv or .txt, it can also be compressed (.gz, .bz2, .xz or a .zip with a single file)")
     parser.add_argument("-o", "--output", help = "Output folder")
+    parser.add_argument("--engine", choices = ofi.ARRAY_ENGINE, default = ofi.ENGINE_AUTO, type = str.lower, help = ofi.mode_information(ofi.ARRAY_ENGINE, ofi.ARRAY_ENGINE_DESCRIPTION))
+    parser.add_argument("--repair-rows", action = "store_true", help = "Repairs the malformed rows of a .csv file instead of skipping them as bad lines: a quote that isn't closed on its line is dropped, the other quoting faults are read like the python engine does and the fields of an unquoted separator are joined in the column where they fit. The repaired rows are flagged in the '%s' column. Not available for Web of Science or with --engine %s" % (ofi.xls_col_repaired, ofi.ENGINE_PYTHON))
+    parser.add_argument("--dedup", choices = ofi.ARRAY_DEDUP, default = ofi.DEDUP_SEQUENTIAL, type = str.lower, help = ofi.mode_information(ofi.ARRAY_DEDUP, ofi.ARRAY_DEDUP_DESCRIPTION))
+    parser.add_argument("--title-key", choices = ofi.ARRAY_TITLE_KEY, default = ofi.TITLE_KEY_SIMPLE, type = str.lower, help = ofi.mode_information(ofi.ARRAY_TITLE_KEY, ofi.ARRAY_TITLE_KEY_DESCRIPTION))
+    parser.add_argument("--corpus", help = "Key list (one DOI or title per line) of the records already seen, e.g. an institutional corpus. The records found are annotated in the '%s' column. A Bloom filter and an index are built next to it on the first use" % ofi.xls_col_previously_seen)
+    parser.add_argument("--canonicalize-doi", action = "store_true", help = "Canonicalizes the DOIs of a .txt file like the other sources (doi: prefixes, links, trailing punctuation), the lines without DOI are reported as bad lines")
+    parser.add_argument("--extra-columns", help = "Columns of the input file (or tags of a RIS file) added to the output after the usual ones, separated by commas, e.g. \"Author Keywords,ISSN\". The other columns are never parsed")
+    parser.add_argument("--parse-authors", action = "store_true", help = "Adds the '%s' (surname) and '%s' ('Surname, Given' names separated by '%s') columns, parsed with the author format of each source" % (ofi.xls_col_first_author, ofi.xls_col_author_list, ofi.AUTHOR_SEPARATOR.strip()))
+    parser.add_argument("--max-memory", type = int, help = "Memory budget of the deduplication index in MB, over it the keys are partitioned into temporary files (slower, but any input size fits)")
+    parser.add_argument("--merge-duplicates", action = "store_true", help = "Coalesces the fields of each group of duplicates into its record of the 'Unique' sheet")
+    parser.add_argument("--merge-rules", help = "Rules of the merge by column, e.g. \"Abstract=longest,Cited By=max\". Rules: %s. Default: %s" % (', '.join(ofi.ARRAY_MERGE_RULE), ','.join(["%s=%s" % (i, j) for i, j in ofi.MERGE_RULES.items()])))
+    parser.add_argument("--cache-dir", help = "Cache folder of the normalized records, repeated runs over the same input skip the parsing")
+    parser.add_argument("--cache-size", type = int, default = ofi.CACHE_SIZE, help = "Maximum size of the cache folder in MB, the least recently used entries are removed (default: %s)" % ofi.CACHE_SIZE)
+    parser.add_argument("--abstracts", choices = ofi.ARRAY_ABSTRACTS, default = ofi.ABSTRACTS_INLINE, type = str.lower, help = ofi.mode_information(ofi.ARRAY_ABSTRACTS, ofi.ARRAY_ABSTRACTS_DESCRIPTION) + ". The file is keyed by the 'Row' column of the sheets")
+    parser.add_argument("--shard-rows", type = int, help = "Maximum rows per sheet of each output workbook, the output is split in several workbooks listed in an index file (.csv)")
+    parser.add_argument("--shard-by", choices = ofi.ARRAY_SHARD_BY, type = str.lower, help = ofi.mode_information(ofi.ARRAY_SHARD_BY, ofi.ARRAY_SHARD_BY_DESCRIPTION))
+    parser.add_argument("--pipeline", action = "store_true", help = "Reads, deduplicates and writes the records at the same time (in batches), only a few batches are in memory at once. Not available with --dedup %s, --merge-duplicates, --abstracts, --shard-rows, --shard-by, --cache-dir or --max-memory" % ofi.DEDUP_CLUSTER)
+    parser.add_argument("-j", "--jobs", type = int, default = ofi.JOBS, help = "Number of processes to use (default: %s)" % ofi.JOBS)
+    parser.add_argument("--progress", choices = ofi.ARRAY_PROGRESS, default = ofi.PROGRESS_AUTO, type = str.lower, help = ofi.mode_information(ofi.ARRAY_PROGRESS, ofi.ARRAY_PROGRESS_DESCRIPTION))
+    parser.add_argument("--status-file", help = "JSON file with the stage, the progress, the throughput and the ETA of the run, rewritten every %s second(s)" % ofi.PROGRESS_INTERVAL)
+    parser.add_argument("--memory-profile", choices = ofi.ARRAY_MEMORY_PROFILE, type = str.lower, help = "Reports the peak memory of each stage and the bytes per record of the main structures, in the log and in the metrics file. " + ofi.mode_information(ofi.ARRAY_MEMORY_PROFILE, ofi.ARRAY_MEMORY_PROFILE_DESCRIPTION))
+    parser.add_argument("--metrics-file", help = "Metrics of the run in the Prometheus text format (.prom), e.g. for the textfile collector of node_exporter")
+    parser.add_argument("--benchmark", type = int, help = "Runs the source (-t) on %s synthetic inputs of geometrically increasing sizes up to the given number of records, instead of an input file, and fits the exponent of the time of each stage. Fails if a stage grows clearly faster than n log n" % ofi.BENCHMARK_STEPS)
     parser.add_argument("--version", action = "version", version = "%s %s" % ('%(prog)s', ofi.VERSION))
     args = parser.parse_args()
 
     ofi.TYPE_FILE = args.type_file
-    file_name = os.path.basename(args.input_file)
-    file_path = os.path.dirname(args.input_file)
-    if file_path is None or file_path == "":
-        file_path = os.getcwd().strip()
+    ofi.ENGINE = args.engine
+    if args.repair_rows:
+        if ofi.TYPE_FILE in [ofi.TYPE_WOS, ofi.TYPE_TXT]:
+            ofi.show_print("%s: error: --repair-rows isn't available for the type '%s'" % (os.path.basename(__file__), ofi.TYPE_FILE), showdate = False, font = ofi.YELLOW)
+            exit()
+        if ofi.ENGINE == ofi.ENGINE_PYTHON:
+            ofi.show_print("%s: error: --repair-rows isn't available with --engine %s" % (os.path.basename(__file__), ofi.ENGINE_PYTHON), showdate = False, font = ofi.YELLOW)
+            exit()
+        ofi.REPAIR_ROWS = True
+    ofi.DEDUP = args.dedup
+    ofi.TITLE_KEY = args.title_key
+    ofi.PROGRESS = args.progress
+    if ofi.PROGRESS == ofi.PROGRESS_AUTO:
+        ofi.PROGRESS = ofi.PROGRESS_TERMINAL if sys.stdout.isatty() else ofi.PROGRESS_LOG
+    if args.status_file:
+        ofi.STATUS_FILE = os.path.abspath(args.status_file)
+        if not ofi.create_directory(os.path.dirname(ofi.STATUS_FILE)):
+            ofi.show_print("%s: error: Couldn't create folder '%s'" % (os.path.basename(__file__), os.path.dirname(ofi.STATUS_FILE)), showdate = False, font = ofi.YELLOW)
+            exit()
+    if args.metrics_file:
+        ofi.METRICS_FILE = os.path.abspath(args.metrics_file)
+        if not ofi.create_directory(os.path.dirname(ofi.METRICS_FILE)):
+            ofi.show_print("%s: error: Couldn't create folder '%s'" % (os.path.basename(__file__), os.path.dirname(ofi.METRICS_FILE)), showdate = False, font = ofi.YELLOW)
+            exit()
+    if args.memory_profile:
+        ofi.MEMORY_PROFILE = args.memory_profile
+        if ofi.MEMORY_PROFILE == ofi.MEMORY_PROFILE_TRACED:
+            tracemalloc.start()
+    ofi.CANONICALIZE_DOI = args.canonicalize_doi
+    if args.extra_columns:
+        if ofi.TYPE_FILE == ofi.TYPE_TXT:
+            ofi.show_print("%s: error: --extra-columns isn't available for the type '%s'" % (os.path.basename(__file__), ofi.TYPE_TXT), showdate = False, font = ofi.YELLOW)
+            exit()
+        for column in args.extra_columns.split(','):
+            column = column.strip()
+            if column in ofi.get_output_columns():
+                ofi.show_print("%s: error: the extra column '%s' is already an output column" % (os.path.basename(__file__), column), showdate = False, font = ofi.YELLOW)
+                exit()
+            if column and column not in ofi.EXTRA_COLUMNS:
+                ofi.EXTRA_COLUMNS.append(column)
+                ofi.MERGE_RULES.update({column: ofi.MERGE_FIRST_NON_EMPTY})
+    if args.parse_authors:
+        if ofi.TYPE_FILE == ofi.TYPE_TXT:
+            ofi.show_print("%s: error: --parse-authors isn't available for the type '%s'" % (os.path.basename(__file__), ofi.TYPE_TXT), showdate = False, font = ofi.YELLOW)
+            exit()
+        ofi.PARSE_AUTHORS = True
+    if args.max_memory is not None:
+        if args.max_memory < 1:
+            ofi.show_print("%s: error: --max-memory must be at least 1" % os.path.basename(__file__), showdate = False, font = ofi.YELLOW)
+            exit()
+        ofi.MAX_MEMORY = args.max_memory
+    if args.corpus:
+        if not os.path.isfile(args.corpus):
+            ofi.show_print("%s: error: the corpus file '%s' doesn't exist" % (os.path.basename(__file__), args.corpus), showdate = False, font = ofi.YELLOW)
+            exit()
+        ofi.CORPUS_FILE = os.path.abspath(args.corpus)
+    ofi.ABSTRACTS = args.abstracts
+    ofi.JOBS = max(1, args.jobs)
+    ofi.SHARD_BY = args.shard_by
+    if args.shard_rows is not None:
+        if args.shard_rows < 1 or args.shard_rows > ofi.XLS_MAX_ROWS - 1:
+            ofi.show_print("%s: error: --shard-rows must be between 1 and %s" % (os.path.basename(__file__), ofi.XLS_MAX_ROWS - 1), showdate = False, font = ofi.YELLOW)
+            exit()
+        ofi.SHARD_ROWS = args.shard_rows
+    elif ofi.SHARD_BY == ofi.SHARD_BY_ROWS:
+        ofi.SHARD_ROWS = ofi.XLS_MAX_ROWS - 1
+    if args.cache_dir:
+        ofi.CACHE_DIR = os.path.abspath(args.cache_dir)
+        ofi.CACHE_SIZE = args.cache_size
+    ofi.MERGE_DUPLICATES = args.merge_duplicates
+    if args.merge_rules:
+        for item in args.merge_rules.split(','):
+            column, _, rule = item.partition('=')
+            column = column.strip()
+            rule = rule.strip().lower()
+            if column not in ofi.MERGE_RULES or rule not in ofi.ARRAY_MERGE_RULE:
+                ofi.show_print("%s: error: invalid merge rule '%s'" % (os.path.basename(__file__), item), showdate = False, font = ofi.YELLOW)
+                exit()
+            ofi.MERGE_RULES.update({column: rule})
+    if args.pipeline:
+        options = [["--dedup %s" % ofi.DEDUP_CLUSTER, ofi.DEDUP == ofi.DEDUP_CLUSTER],
+                   ["--merge-duplicates", ofi.MERGE_DUPLICATES],
+                   ["--abstracts %s" % ofi.ABSTRACTS, ofi.ABSTRACTS != ofi.ABSTRACTS_INLINE],
+                   ["--shard-rows", args.shard_rows is not None],
+                   ["--shard-by", ofi.SHARD_BY],
+                   ["--cache-dir", ofi.CACHE_DIR],
+                   ["--max-memory", ofi.MAX_MEMORY]]
+        for option, used in options:
+            if used:
+                ofi.show_print("%s: error: --pipeline isn't available with %s" % (os.path.basename(__file__), option), showdate = False, font = ofi.YELLOW)
+                exit()
+        ofi.PIPELINE = True
+    if args.benchmark is not None:
+        if args.benchmark < ofi.BENCHMARK_MIN_SIZE:
+            ofi.show_print("%s: error: --benchmark must be at least %s" % (os.path.basename(__file__), ofi.BENCHMARK_MIN_SIZE), showdate = False, font = ofi.YELLOW)
+            exit()
+        ofi.BENCHMARK = args.benchmark
+    elif not args.input_file:
+        ofi.show_print("%s: error: the following arguments are required: -i/--input_file" % os.path.basename(__file__), showdate = False, font = ofi.YELLOW)
+        exit()
+
+    if args.input_file:
+        file_name = os.path.basename(args.input_file)
+        file_path = os.path.dirname(args.input_file)
+        if file_path is None or file_path == "":
+            file_path = os.getcwd().strip()
 
-    ofi.INPUT_FILE = os.path.join(file_path, file_name)
-    if not ofi.check_path(ofi.INPUT_FILE):
+        ofi.INPUT_FILE = os.path.join(file_path, file_name)
+    if not ofi.BENCHMARK and not ofi.check_path(ofi.INPUT_FILE):
         ofi.show_print("%s: error: the file '%s' doesn't exist" % (os.path.basename(__file__), ofi.INPUT_FILE), showdate = False, font = ofi.YELLOW)
         ofi.show_print("%s: error: the following arguments are required: -i/--input_file" % os.path.basename(__file__), showdate = False, font = ofi.YELLOW)
         exit()
@@ -60,6 +213,7 @@ class FormatInput:
         self.INPUT_FILE = None
         self.TYPE_FILE = None
         self.OUTPUT_PATH = None
+        self.ENGINE = None
 
         self.ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
         self.LOG_NAME = "run_%s_%s.log" % (os.path.splitext(os.path.basename(__file__))[0], time.strftime('%Y%m%d'))
@@ -80,19 +234,19 @@ class FormatInput:
         self.TYPE_CAB = "cab"
         self.TYPE_SCIELO = "scielo"
         self.TYPE_TXT = "txt"
-        self.DESCRIPTION_SCOPUS = "Indicates that the file (.csv) was exported from Scopus"
-        self.DESCRIPTION_WOS = "Indicates that the file (.csv) was exported from Web of Science"
+        self.DESCRIPTION_SCOPUS = "Indicates that the file (.csv or .ris) was exported from Scopus"
+        self.DESCRIPTION_WOS = "Indicates that the file (.csv or .ris) was exported from Web of Science"
         self.DESCRIPTION_PUBMED = "Indicates that the file (.csv) was exported from PubMed"
         self.DESCRIPTION_PUBMED_CENTRAL = "Indicates that the file (.txt) was exported from PubMed Central, necessarily in MEDLINE format"
         self.DESCRIPTION_DIMENSIONS = "Indicates that the file (.csv) was exported from Dimensions"
         self.DESCRIPTION_GOOGLE_SCHOLAR = "Indicates that the file (.csv) was exported from Publish or Perish (Google Scholar option)"
-        self.DESCRIPTION_COCHRANE = "Indicates that the file (.csv) was exported from Cochrane"
-        self.DESCRIPTION_EMBASE = "Indicates that the file (.csv) was exported from Embase"
+        self.DESCRIPTION_COCHRANE = "Indicates that the file (.csv or .ris) was exported from Cochrane"
+        self.DESCRIPTION_EMBASE = "Indicates that the file (.csv or .ris) was exported from Embase"
         self.DESCRIPTION_SCIENCEDIRECT = "Indicates that the file (.ris) was exported from ScienceDirect"
-        self.DESCRIPTION_IEEE = "Indicates that the file (.csv) was exported from IEEE"
+        self.DESCRIPTION_IEEE = "Indicates that the file (.csv or .ris) was exported from IEEE"
         self.DESCRIPTION_BVS = "Indicates that the file (.csv) was exported from BVS"
         self.DESCRIPTION_CAB = "Indicates that the file (.csv) was exported from CAB"
-        self.DESCRIPTION_SCIELO = "Indicates that the file (.csv) was exported from SciELO"
+        self.DESCRIPTION_SCIELO = "Indicates that the file (.csv or .ris) was exported from SciELO"
         self.DESCRIPTION_TXT = "Indicates that it is a text file (.txt)"
         self.ARRAY_TYPE = [self.TYPE_SCOPUS,
                            self.TYPE_WOS,
@@ -140,6 +294,7 @@ class FormatInput:
         self.wos_col_title = 'TI'
         self.wos_col_year = 'PY'
         self.wos_col_doi = 'DI'
+        self.wos_col_book_doi = 'D2'
         self.wos_col_document_type = 'DT'
         self.wos_col_language = 'LA'
         self.wos_col_cited_by = 'TC'
@@ -150,6 +305,7 @@ class FormatInput:
         self.pubmed_col_title = 'Title'
         self.pubmed_col_year = 'Publication Year'
         self.pubmed_col_doi = 'DOI'
+        self.pubmed_col_citation = 'Citation'
         self.pubmed_col_document_type = '' # Doesn't exist
         self.pubmed_col_language = '' # Doesn't exist
         self.pubmed_col_cited_by = '' # Doesn't exist
@@ -180,6 +336,8 @@ class FormatInput:
         self.scholar_col_title = 'Title'
         self.scholar_col_year = 'Year'
         self.scholar_col_doi = 'DOI'
+        self.scholar_col_article_url = 'ArticleURL'
+        self.scholar_col_full_text_url = 'FullTextURL'
         self.scholar_col_document_type = '' # Doesn't exist
         self.scholar_col_language = '' # Doesn't exist
         self.scholar_col_cited_by = 'Cites'
@@ -200,6 +358,7 @@ class FormatInput:
         self.embase_col_title = 'Title'
         self.embase_col_year = 'Publication Year'
         self.embase_col_doi = 'DOI'
+        self.embase_col_full_text_link = 'Full Text Link'
         self.embase_col_document_type = 'Publication Type'
         self.embase_col_language = 'Article Language'
         self.embase_col_cited_by = '' # Doesn't exist
@@ -210,6 +369,7 @@ class FormatInput:
         self.sciencedirect_col_title = 'T1'
         self.sciencedirect_col_year = 'PY'
         self.sciencedirect_col_doi = 'DO'
+        self.sciencedirect_col_link = 'UR'
         self.sciencedirect_col_document_type = '' # Doesn't exist
         self.sciencedirect_col_language = '' # Doesn't exist
         self.sciencedirect_col_cited_by = '' # Doesn't exist
@@ -251,9 +411,83 @@ class FormatInput:
         self.XLS_SHEET_WITHOUT_DOI = 'Without DOI'
         self.XLS_SHEET_DUPLICATES = 'Duplicates'
 
+        # Abstracts
+        self.ABSTRACTS = None
+        self.ABSTRACTS_INLINE = 'inline'
+        self.ABSTRACTS_SNIPPET = 'snippet'
+        self.ABSTRACTS_NONE = 'none'
+        self.ABSTRACTS_FILE = 'abstracts_<type>.jsonl.gz'
+        self.ABSTRACT_SNIPPET_LENGTH = 150
+        self.DESCRIPTION_ABSTRACTS_INLINE = "Writes the abstracts in the sheets (default)"
+        self.DESCRIPTION_ABSTRACTS_SNIPPET = "Writes the abstracts to '%s' and the first %s characters in the sheets" % (self.ABSTRACTS_FILE, self.ABSTRACT_SNIPPET_LENGTH)
+        self.DESCRIPTION_ABSTRACTS_NONE = "Writes the abstracts to '%s' only" % self.ABSTRACTS_FILE
+        self.ARRAY_ABSTRACTS = [self.ABSTRACTS_INLINE,
+                                self.ABSTRACTS_SNIPPET,
+                                self.ABSTRACTS_NONE]
+        self.ARRAY_ABSTRACTS_DESCRIPTION = [self.DESCRIPTION_ABSTRACTS_INLINE,
+                                            self.DESCRIPTION_ABSTRACTS_SNIPPET,
+                                            self.DESCRIPTION_ABSTRACTS_NONE]
+
+        # Sharding of the output
+        self.XLS_MAX_ROWS = 1048576 # Row limit of an Excel worksheet, header included
+        self.XLS_INDEX_FILE = 'input_<type>_index.csv'
+        self.SHARD_ROWS = None
+        self.SHARD_BY = None
+        self.SHARD_BY_ROWS = 'rows'
+        self.SHARD_BY_YEAR = 'year'
+        self.SHARD_UNKNOWN = 'unknown'
+        self.DESCRIPTION_SHARD_BY_ROWS = "Splits the output in workbooks of --shard-rows rows per sheet (default)"
+        self.DESCRIPTION_SHARD_BY_YEAR = "Writes a workbook per publication year, records without year go to '<file>_%s.xlsx'" % self.SHARD_UNKNOWN
+        self.ARRAY_SHARD_BY = [self.SHARD_BY_ROWS,
+                               self.SHARD_BY_YEAR]
+        self.ARRAY_SHARD_BY_DESCRIPTION = [self.DESCRIPTION_SHARD_BY_ROWS,
+                                           self.DESCRIPTION_SHARD_BY_YEAR]
+        self.JOBS = os.cpu_count() or 1
+
         # Bad Summary
         self.TXT_BAD_FILE = 'bad_lines_<type>.txt'
 
+        # Compressed input, detected by magic bytes
+        self.MAGIC_NUMBERS = {b'\x1f\x8b': 'gzip',
+                              b'BZh': 'bz2',
+                              b'\xfd7zXZ\x00': 'xz',
+                              b'PK\x03\x04': 'zip'}
+
+        # Cache of normalized records
+        self.CACHE_DIR = None
+        self.CACHE_SIZE = 1024 # MB
+        self.CACHE_EXTENSION = '.pkl'
+        self.CACHE_RECORDS = 'records'
+        self.CACHE_BAD_LINES = 'bad'
+
+        # Csv parsing
+        self.CSV_REPARSE_GAP = 100 # Problem regions closer than this (lines) are re-parsed together
+        self.CSV_CHUNK_SIZE = 64 * 1024 * 1024 # Bytes parsed by each process (-j)
+        self.CSV_PARALLEL_SIZE = 2 * self.CSV_CHUNK_SIZE # Smaller files are parsed in a single process
+        self.REPAIR_ROWS = False
+        self.CSV_REPAIRED = '__repaired__' # Column of the repairs in the parsed frames
+        self.CSV_REPAIR_QUOTE = 'Unclosed quote'
+        self.CSV_REPAIR_FIELDS = 'Extra fields'
+        self.CSV_REPAIR_STRAY = 'Stray quote'
+        self.CSV_SHAPE_NUMBER = re.compile(r'^\d+$')
+        self.CSV_SHAPE_YEAR = re.compile(r'^\d{4}\b')
+        self.CSV_SHAPE_DOI = re.compile(r'\b10\.\d+/')
+        self.CSV_SHAPES = [self.CSV_SHAPE_NUMBER, self.CSV_SHAPE_DOI] # Shapes learned from the values of a column
+        self.CSV_SHAPE_RATIO = 0.9 # Share of the values of a column with the shape
+        self.CSV_SHAPE_SAMPLE = 1000 # Rows of a region used to learn the shapes
+        self.ENGINE_AUTO = "auto"
+        self.ENGINE_PYTHON = "python"
+        self.ENGINE_ARROW = "arrow"
+        self.DESCRIPTION_ENGINE_AUTO = "Uses the C parser and re-reads only the malformed regions with the python parser (default)"
+        self.DESCRIPTION_ENGINE_PYTHON = "Uses the python parser for the whole file, except for Web of Science"
+        self.DESCRIPTION_ENGINE_ARROW = "Uses the multithreaded pyarrow parser, falls back to 'auto' if pyarrow isn't installed or the file has malformed lines"
+        self.ARRAY_ENGINE = [self.ENGINE_AUTO,
+                             self.ENGINE_PYTHON,
+                             self.ENGINE_ARROW]
+        self.ARRAY_ENGINE_DESCRIPTION = [self.DESCRIPTION_ENGINE_AUTO,
+                                         self.DESCRIPTION_ENGINE_PYTHON,
+                                         self.DESCRIPTION_ENGINE_ARROW]
+
         # Xls Columns
         self.xls_col_item = 'Item'
         self.xls_col_title = 'Title'
@@ -265,10 +499,205 @@ class FormatInput:
         self.xls_col_cited_by = 'Cited By'
         self.xls_col_authors = 'Author(s)'
 
+        self.xls_col_row = 'Row'
+        self.xls_col_cluster = 'Cluster'
+        self.xls_col_canonical = 'Canonical Row'
+        self.xls_col_previously_seen = 'Previously Seen'
+        self.xls_col_repaired = 'Repaired'
+        self.xls_col_first_author = 'First Author'
+        self.xls_col_author_list = 'Author List'
+
         self.xls_col_duplicate_type = 'Duplicate Type'
         self.xls_val_by_doi = 'By DOI'
         self.xls_val_by_title = 'By Title'
 
+        # Deduplication
+        self.DEDUP = None
+        self.DEDUP_SEQUENTIAL = 'sequential'
+        self.DEDUP_CLUSTER = 'cluster'
+        self.DESCRIPTION_DEDUP_SEQUENTIAL = "Deduplicates the records with DOI by DOI and then by title (default)"
+        self.DESCRIPTION_DEDUP_CLUSTER = "Clusters all the records by DOI and title (transitively), the 'Duplicates' sheet only references the row, the cluster and the canonical row of each duplicate"
+        self.ARRAY_DEDUP = [self.DEDUP_SEQUENTIAL,
+                            self.DEDUP_CLUSTER]
+        self.ARRAY_DEDUP_DESCRIPTION = [self.DESCRIPTION_DEDUP_SEQUENTIAL,
+                                        self.DESCRIPTION_DEDUP_CLUSTER]
+
+        # Title keys
+        self.TITLE_KEY = None
+        self.TITLE_KEYS = None # {row: key}, when they are computed while reading
+        self.TITLE_KEY_SIMPLE = 'simple'
+        self.TITLE_KEY_UNICODE = 'unicode'
+        self.TITLE_KEY_ASCII = 'ascii'
+        self.DESCRIPTION_TITLE_KEY_SIMPLE = "Compares the titles in lowercase without the final period (default)"
+        self.DESCRIPTION_TITLE_KEY_UNICODE = "Compares the titles after the Unicode normalization (NFKC), the case folding and without HTML entities, punctuation and extra whitespace"
+        self.DESCRIPTION_TITLE_KEY_ASCII = "Same as '%s' and also without diacritics" % self.TITLE_KEY_UNICODE
+        self.ARRAY_TITLE_KEY = [self.TITLE_KEY_SIMPLE,
+                                self.TITLE_KEY_UNICODE,
+                                self.TITLE_KEY_ASCII]
+        self.ARRAY_TITLE_KEY_DESCRIPTION = [self.DESCRIPTION_TITLE_KEY_SIMPLE,
+                                            self.DESCRIPTION_TITLE_KEY_UNICODE,
+                                            self.DESCRIPTION_TITLE_KEY_ASCII]
+        self.TITLE_TABLES = {}
+        self.TITLE_APOSTROPHES = '\'`\u00b4\u2018\u2019\u201b\u02bc\u02b9\u2032'
+        self.TITLE_LIGATURES = {'\u00f8': 'o', '\u0142': 'l', '\u0111': 'd', '\u00f0': 'd', '\u00fe': 'th', '\u00e6': 'ae', '\u0153': 'oe', '\u0131': 'i'}
+
+        # Progress
+        self.PROGRESS = None
+        self.PROGRESS_AUTO = 'auto'
+        self.PROGRESS_TERMINAL = 'terminal'
+        self.PROGRESS_LOG = 'log'
+        self.PROGRESS_NONE = 'none'
+        self.DESCRIPTION_PROGRESS_AUTO = "Terminal if the output is interactive, log otherwise (default)"
+        self.DESCRIPTION_PROGRESS_TERMINAL = "Updates one line of the terminal every %s second(s)"
+        self.DESCRIPTION_PROGRESS_LOG = "Writes a line to the log every %s seconds"
+        self.DESCRIPTION_PROGRESS_NONE = "No progress"
+        self.ARRAY_PROGRESS = [self.PROGRESS_AUTO,
+                               self.PROGRESS_TERMINAL,
+                               self.PROGRESS_LOG,
+                               self.PROGRESS_NONE]
+        self.PROGRESS_INTERVAL = 1 # Seconds between updates of the terminal and the status file
+        self.PROGRESS_LOG_INTERVAL = 30 # Seconds between lines of the log
+        self.DESCRIPTION_PROGRESS_TERMINAL = self.DESCRIPTION_PROGRESS_TERMINAL % self.PROGRESS_INTERVAL
+        self.DESCRIPTION_PROGRESS_LOG = self.DESCRIPTION_PROGRESS_LOG % self.PROGRESS_LOG_INTERVAL
+        self.ARRAY_PROGRESS_DESCRIPTION = [self.DESCRIPTION_PROGRESS_AUTO,
+                                           self.DESCRIPTION_PROGRESS_TERMINAL,
+                                           self.DESCRIPTION_PROGRESS_LOG,
+                                           self.DESCRIPTION_PROGRESS_NONE]
+        self.STATUS_FILE = None
+        self.PROGRESS_STATE = None # Stage being reported
+        self.PROGRESS_COUNT = 0 # Items done by the stage
+        self.PROGRESS_INPUT = None # (file descriptor, size) of the file being read
+        self.PROGRESS_LOCK = threading.Lock()
+        self.PROGRESS_LINE = False # A progress line is shown in the terminal
+        self.STAGE_CURRENT = None # (stage, start time)
+        self.STAGE_TIMES = {} # Seconds by stage
+        self.STAGE_READING = 'Reading'
+        self.STAGE_CONVERTING = 'Converting'
+        self.STAGE_NORMALIZING = 'Normalizing'
+        self.STAGE_DEDUPLICATING = 'Deduplicating'
+        self.STAGE_WRITING = 'Writing'
+        self.STAGE_DONE = 'Done'
+        self.STAGE_FAILED = 'Failed'
+
+        # Memory profile
+        self.MEMORY_PROFILE = None
+        self.MEMORY_PROFILE_RSS = 'rss'
+        self.MEMORY_PROFILE_TRACED = 'traced'
+        self.DESCRIPTION_MEMORY_PROFILE_RSS = "Peak resident memory of each stage"
+        self.DESCRIPTION_MEMORY_PROFILE_TRACED = "Also the peak memory allocated by Python (tracemalloc), several times slower and its bookkeeping adds to the resident memory"
+        self.ARRAY_MEMORY_PROFILE = [self.MEMORY_PROFILE_RSS,
+                                     self.MEMORY_PROFILE_TRACED]
+        self.ARRAY_MEMORY_PROFILE_DESCRIPTION = [self.DESCRIPTION_MEMORY_PROFILE_RSS,
+                                                 self.DESCRIPTION_MEMORY_PROFILE_TRACED]
+        self.MEMORY_STAGES = {} # {stage: (peak resident, peak allocated by Python)} in bytes
+        self.MEMORY_STRUCTURES = {} # {structure: (bytes, records)}
+        self.MEMORY_SAMPLE = 1000 # Items measured per structure
+        self.STRUCTURE_FRAME = 'Parsed frame'
+        self.STRUCTURE_RECORDS = 'Records'
+        self.STRUCTURE_TITLE_KEYS = 'Title keys'
+        self.STRUCTURE_DOI_INDEX = 'DOI index'
+        self.STRUCTURE_TITLE_INDEX = 'Title index'
+
+        # Scaling benchmark
+        self.BENCHMARK = None # Records of the biggest input
+        self.BENCHMARK_MIN_SIZE = 1000
+        self.BENCHMARK_STEPS = 5 # Sizes, each one BENCHMARK_FACTOR times the previous
+        self.BENCHMARK_FACTOR = 2
+        self.BENCHMARK_CYCLE = 20 # Records per repetition of the mix of duplicates
+        self.BENCHMARK_TOLERANCE = 0.2 # Over the exponent of n log n
+        self.BENCHMARK_MIN_SECONDS = 0.2 # Faster stages are timing noise
+        self.BENCHMARK_CATEGORIES = ['Article', 'Review', 'Letter']
+
+        # Metrics (Prometheus text format)
+        self.METRICS_FILE = None
+        self.METRICS_PREFIX = 'format_input'
+
+        # DOI list (txt)
+        self.CANONICALIZE_DOI = False
+
+        # Records written as they are read (DOI lists and --pipeline)
+        self.STREAM_RECORDS = 'records'
+        self.PIPELINE = False
+        self.PIPELINE_QUEUE_SIZE = 2 # Batches between two stages
+        self.PIPELINE_CHUNK_SIZE = 2 * 1024 * 1024 # Bytes of csv parsed per batch
+
+        # Columns of the input added to the output (the rest aren't parsed)
+        self.EXTRA_COLUMNS = []
+
+        # Dtypes of the parsed columns
+        self.DTYPE_TEXT = pd.StringDtype('pyarrow') if pyarrow is not None else pd.StringDtype()
+        self.DTYPE_CATEGORY = 'category'
+        self.DTYPE_INTEGER = 'Int64'
+        self.YEAR_PATTERN = r'\d{4}'
+        self.INTEGER_PATTERN = r'\d+'
+        self.COUNTS = 'counts'
+
+        # Memory budget of the dedup index (MB)
+        self.MAX_MEMORY = None
+        self.DEDUP_ENTRY_SIZE = 100 # Bytes per index entry besides its key
+        self.DEDUP_DUPLICATE_SIZE = 100 # Bytes per entry of the duplicates ({position: position})
+        self.DEDUP_CHUNK = 100000 # Titles normalized at once
+        self.DEDUP_BUFFER_SIZE = 1000 # Keys per write of a partition
+        self.DEDUP_MAX_PARTITIONS = 512
+
+        # Corpus of previously seen records
+        self.CORPUS_FILE = None
+        self.CORPUS_FALSE_POSITIVE = 0.01
+        self.CORPUS_CHUNK = 1000000 # Keys per build step
+        self.CORPUS_QUERY_SIZE = 500 # Keys per index query
+        self.CORPUS_MAGIC = b'FIBLOOM1'
+        self.CORPUS_BLOOM_EXTENSION = '.bloom'
+        self.CORPUS_INDEX_EXTENSION = '.sqlite'
+        self.CORPUS_KEY_DOI = 'doi:'
+        self.CORPUS_KEY_TITLE = 'title:'
+
+        # DOIs, found anywhere in a value (doi: prefixes, doi.org and
+        # dx.doi.org links, publisher URLs, citations). The last character
+        # can't be a punctuation mark of the surrounding text, a closing
+        # parenthesis only if it closes one of the DOI. The query strings of
+        # the URLs aren't part of it
+        self.DOI_PATTERN = re.compile(r'(10\.\d+(?:\.\d+)*/[^\s"]*[^\s".,;:\'!\]}>])')
+        self.DOI_URL_QUERY = re.compile(r'(://[^\s?#]*)[?#][^\s"]*')
+        self.DOI_PUNCTUATION = '.,;:\'!]}>'
+        self.DOI_ENCODED_SLASH = re.compile(r'%2f', re.IGNORECASE)
+        self.DOI_URL_SUFFIX = re.compile(r'(?:/(?:abstract|full|pdf|epdf|meta)|\.pdf)$')
+
+        # Author fields parsed into the first author surname and a list of
+        # 'Surname, Given' names. Separators of the authors by source (the
+        # first one found in the field), the comma lists can also be 'Surname, Given'
+        self.PARSE_AUTHORS = False
+        self.AUTHOR_CACHE = collections.OrderedDict()
+        self.AUTHOR_CACHE_SIZE = 100000 # Distinct author fields kept parsed (LRU)
+        self.AUTHOR_SEPARATOR = '; '
+        self.AUTHOR_SEPARATORS = [';', ',']
+        self.AUTHOR_SEPARATORS_TYPE = {self.TYPE_WOS: [';'],
+                                       self.TYPE_SCIELO: [';'],
+                                       self.TYPE_PUBMED_CENTRAL: [';'],
+                                       self.TYPE_DIMENSIONS: [';'],
+                                       self.TYPE_IEEE: [';'],
+                                       self.TYPE_BVS: [';'],
+                                       self.TYPE_CAB: [';']}
+        self.AUTHOR_INITIALS = re.compile(r'(?:[A-Z]\.?-?){1,4}')
+        self.AUTHOR_SKIP = re.compile(r'et al\.?|\.\.\.|\u2026', re.IGNORECASE)
+
+        # Merge of duplicates, rules by column
+        self.MERGE_DUPLICATES = False
+        self.MERGE_FIRST = 'first'
+        self.MERGE_FIRST_NON_EMPTY = 'first_non_empty'
+        self.MERGE_LONGEST = 'longest'
+        self.MERGE_MAX = 'max'
+        self.ARRAY_MERGE_RULE = [self.MERGE_FIRST,
+                                 self.MERGE_FIRST_NON_EMPTY,
+                                 self.MERGE_LONGEST,
+                                 self.MERGE_MAX]
+        self.MERGE_RULES = {self.xls_col_title: self.MERGE_FIRST_NON_EMPTY,
+                            self.xls_col_abstract: self.MERGE_LONGEST,
+                            self.xls_col_year: self.MERGE_FIRST_NON_EMPTY,
+                            self.xls_col_document_type: self.MERGE_FIRST_NON_EMPTY,
+                            self.xls_col_language: self.MERGE_FIRST_NON_EMPTY,
+                            self.xls_col_cited_by: self.MERGE_MAX,
+                            self.xls_col_authors: self.MERGE_FIRST_NON_EMPTY}
+
         self.xls_columns_csv = [self.xls_col_item,
                                 self.xls_col_title,
                                 self.xls_col_abstract,
@@ -282,6 +711,13 @@ class FormatInput:
         self.xls_columns_txt = [self.xls_col_item,
                                 self.xls_col_doi]
 
+        self.xls_index_columns = ['File', 'Sheet', 'First Item', 'Last Item', 'Rows']
+
+        self.xls_columns_compact = [self.xls_col_item,
+                                    self.xls_col_cluster,
+                                    self.xls_col_canonical,
+                                    self.xls_col_duplicate_type]
+
         # PubMed Central | MEDLINE
         self.MEDLINE_START = ['AB  -',
                               'AD  -',
@@ -335,20 +771,70 @@ class FormatInput:
         self.param_pmc_doi = 'doi'
         self.param_pmc_author = 'author'
 
-        # ScienceDirect
-        self.param_sciencedirect_title = 'T1'
-        self.param_sciencedirect_authors = 'AU'
-        self.param_sciencedirect_journal = 'JO'
-        self.param_sciencedirect_publication_year = 'PY'
-        self.param_sciencedirect_volume = 'VL'
-        self.param_sciencedirect_first_page = 'SP'
-        self.param_sciencedirect_last_page = 'EP'
-        self.param_sciencedirect_publication_date = 'DA'
-        self.param_sciencedirect_issn = 'SN'
-        self.param_sciencedirect_abstract = 'AB'
-        self.param_sciencedirect_keywords = 'KW'
-        self.param_sciencedirect_doi = 'DO'
-        self.param_sciencedirect_sciencedirect_link = 'UR'
+        # RIS (tags of two characters, "TY  - " starts a record and "ER  - " ends it)
+        self.RIS_LINE = re.compile(r'^([A-Z][A-Z0-9])  -(?: (.*))?$')
+        self.RIS_TAG = re.compile(r'^[A-Z][A-Z0-9]$')
+        self.RIS_YEAR = re.compile(r'^\s*(\d{4})')
+        self.RIS_CITED_BY = re.compile(r'cited[^:;\d]*:\s*(\d+)', re.IGNORECASE)
+        self.RIS_TAG_TYPE = 'TY'
+        self.RIS_TAG_END = 'ER'
+        self.RIS_SEPARATOR = '; '
+        self.RIS_DETECT_LINES = 10 # Lines read to recognize a RIS file
+        self.RIS_MULTIPLE = ['AU', 'A1', 'A2', 'A3', 'A4', 'KW', 'UR', 'L1', 'L2', 'L3', 'L4', 'N1'] # Tags repeated once per value
+        self.RIS_TYPES = {'ABST': 'Abstract',
+                          'BOOK': 'Book',
+                          'CHAP': 'Book Chapter',
+                          'CONF': 'Conference Proceeding',
+                          'CPAPER': 'Conference Paper',
+                          'DATA': 'Dataset',
+                          'EBOOK': 'Electronic Book',
+                          'ECHAP': 'Electronic Book Section',
+                          'EJOUR': 'Electronic Article',
+                          'GEN': 'Generic',
+                          'JOUR': 'Journal Article',
+                          'MGZN': 'Magazine Article',
+                          'NEWS': 'Newspaper',
+                          'PAT': 'Patent',
+                          'RPRT': 'Report',
+                          'SER': 'Serial Publication',
+                          'THES': 'Thesis',
+                          'UNPB': 'Unpublished Work'}
+        self.RIS_DOI_FALLBACK = 'doi_fallback'
+
+        # Tags of each field (in order of preference), the same for all databases
+        self.RIS_FIELDS = {self.xls_col_authors: ['AU', 'A1'],
+                           self.xls_col_title: ['TI', 'T1', 'CT'],
+                           self.xls_col_abstract: ['AB', 'N2'],
+                           self.xls_col_year: ['PY', 'Y1', 'DA', 'Y2'],
+                           self.xls_col_doi: ['DO'],
+                           self.RIS_DOI_FALLBACK: ['UR', 'L3', 'L1', 'L2', 'N1'],
+                           self.xls_col_document_type: ['TY'],
+                           self.xls_col_language: ['LA'],
+                           self.xls_col_cited_by: []}
+
+        # Differences of each database
+        self.RIS_FIELDS_TYPE = {self.TYPE_SCOPUS: {self.xls_col_cited_by: ['N1']},
+                                self.TYPE_WOS: {self.xls_col_cited_by: ['N1']},
+                                self.TYPE_EMBASE: {self.xls_col_document_type: ['M3', 'TY']},
+                                self.TYPE_SCIENCEDIRECT: {self.xls_col_authors: [self.sciencedirect_col_authors],
+                                                          self.xls_col_title: [self.sciencedirect_col_title],
+                                                          self.xls_col_abstract: [self.sciencedirect_col_abstract],
+                                                          self.xls_col_year: [self.sciencedirect_col_year],
+                                                          self.xls_col_doi: [self.sciencedirect_col_doi],
+                                                          self.RIS_DOI_FALLBACK: [self.sciencedirect_col_link],
+                                                          self.xls_col_document_type: None,
+                                                          self.xls_col_language: None,
+                                                          self.xls_col_cited_by: None}}
+
+        # Databases that can be exported as RIS (recognized by the content),
+        # ScienceDirect is always RIS
+        self.ARRAY_TYPE_RIS = [self.TYPE_SCOPUS,
+                               self.TYPE_WOS,
+                               self.TYPE_SCIELO,
+                               self.TYPE_EMBASE,
+                               self.TYPE_COCHRANE,
+                               self.TYPE_IEEE,
+                               self.TYPE_SCIENCEDIRECT]
 
         # Fonts
         self.RED = '\033[31m'
@@ -358,6 +844,17 @@ class FormatInput:
         self.BIGREEN = '\033[1;92m'
         self.END = '\033[0m'
 
+    def __getstate__(self):
+        # Worker processes receive a copy without the progress reporting and
+        # with empty caches
+        state = self.__dict__.copy()
+        state.update({'PROGRESS_STATE': None, 'PROGRESS_INPUT': None, 'PROGRESS_LOCK': None, 'TITLE_KEYS': None, 'AUTHOR_CACHE': collections.OrderedDict()})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.PROGRESS_LOCK = threading.Lock()
+
     def show_print(self, message, logs = None, showdate = True, font = None):
         msg_print = message
         msg_write = message
@@ -370,7 +867,11 @@ class FormatInput:
             msg_print = "%s %s" % (_time, msg_print)
             msg_write = "%s %s" % (_time, message)
 
-        print(msg_print)
+        with self.PROGRESS_LOCK:
+            if self.PROGRESS_LINE:
+                sys.stdout.write('\r\033[K')
+                self.PROGRESS_LINE = False
+            print(msg_print)
         if logs:
             for log in logs:
                 if log:
@@ -389,6 +890,242 @@ class FormatInput:
         else:
             return "%s: %s" % (message, runtime)
 
+    def progress_start(self, stage, unit, total = None, poll = None):
+        # The progress of a stage is reported from a background thread, so the
+        # stage itself only increases PROGRESS_COUNT (or reads its input file)
+        self.progress_stop()
+        self.STAGE_CURRENT = (stage, time.time())
+        if self.MEMORY_PROFILE:
+            self.reset_memory_peak()
+        if self.PROGRESS in [None, self.PROGRESS_NONE] and not self.STATUS_FILE:
+            return
+
+        self.PROGRESS_COUNT = 0
+        self.PROGRESS_INPUT = None
+        state = {'stage': stage,
+                 'unit': unit,
+                 'poll': poll or (lambda: (self.PROGRESS_COUNT, total)),
+                 'start': time.time(),
+                 'stop': threading.Event()}
+        state['thread'] = threading.Thread(target = self.progress_report, args = (state,), daemon = True)
+        self.PROGRESS_STATE = state
+        state['thread'].start()
+
+    def progress_stop(self):
+        if self.STAGE_CURRENT:
+            stage, start = self.STAGE_CURRENT
+            self.STAGE_TIMES.update({stage: self.STAGE_TIMES.get(stage, 0) + time.time() - start})
+            if self.MEMORY_PROFILE:
+                peaks = self.get_memory_peak()
+                self.MEMORY_STAGES.update({stage: tuple(max(i or 0, j) if i is not None else None for i, j in zip(peaks, self.MEMORY_STAGES.get(stage, (0, 0))))})
+            self.STAGE_CURRENT = None
+
+        state = self.PROGRESS_STATE
+        if state:
+            state['stop'].set()
+            state['thread'].join()
+            self.PROGRESS_STATE = None
+            self.PROGRESS_INPUT = None
+            with self.PROGRESS_LOCK:
+                if self.PROGRESS_LINE:
+                    sys.stdout.write('\r\033[K')
+                    sys.stdout.flush()
+                    self.PROGRESS_LINE = False
+
+    def progress_report(self, state):
+        last_log = state['start']
+        while not state['stop'].wait(self.PROGRESS_INTERVAL):
+            message, status = self.get_progress(state)
+            if self.STATUS_FILE:
+                self.save_status(status)
+            if self.PROGRESS == self.PROGRESS_TERMINAL:
+                with self.PROGRESS_LOCK:
+                    sys.stdout.write("\r%s\033[K" % message)
+                    sys.stdout.flush()
+                    self.PROGRESS_LINE = True
+            elif self.PROGRESS == self.PROGRESS_LOG and time.time() - last_log >= self.PROGRESS_LOG_INTERVAL:
+                last_log = time.time()
+                self.show_print(message, [self.LOG_FILE])
+
+    def poll_input(self):
+        # Position of the file being read (compressed files: in the compressed file)
+        done, total = 0, None
+        if self.PROGRESS_INPUT:
+            fd, total = self.PROGRESS_INPUT
+            try:
+                done = min(os.lseek(fd, 0, os.SEEK_CUR), total)
+            except OSError:
+                done = total # Closed
+        return done, total
+
+    def get_progress(self, state):
+        done, total = state['poll']()
+        elapsed = time.time() - state['start']
+        rate = done / elapsed if elapsed > 0 else 0
+        eta = (total - done) / rate if total and rate > 0 else None
+
+        scale = 1024 * 1024 if state['unit'] == 'MB' else 1
+        if state['unit'] == 'MB':
+            _done, _total, _rate = "%.1f" % (done / scale), "%.1f" % ((total or 0) / scale), "%.1f" % (rate / scale)
+        else:
+            _done, _total, _rate = str(done), str(total), str(int(rate))
+
+        if total:
+            message = "  %s: %.1f%% (%s of %s %s, %s %s/s" % (state['stage'], 100 * done / total, _done, _total, state['unit'], _rate, state['unit'])
+            if eta is not None:
+                message = "%s, ETA %s" % (message, time.strftime("%H:%M:%S", time.gmtime(eta)))
+            message = "%s)" % message
+        else:
+            message = "  %s: %s %s (%s %s/s)" % (state['stage'], _done, state['unit'], _rate, state['unit'])
+
+        status = {'stage': state['stage'],
+                  'unit': state['unit'],
+                  'done': round(done / scale, 1),
+                  'total': round(total / scale, 1) if total else None,
+                  'percent': round(100 * done / total, 1) if total else None,
+                  'rate': round(rate / scale, 1),
+                  'eta': round(eta) if eta is not None else None,
+                  'elapsed': round(elapsed)}
+        return message, status
+
+    def save_status(self, status):
+        # Atomic, a batch system never reads a partial file
+        status = dict(status, input = self.INPUT_FILE, pid = os.getpid(), updated = time.strftime('%Y-%m-%d %H:%M:%S'))
+        try:
+            fw_tmp = tempfile.NamedTemporaryFile(mode = 'w', dir = os.path.dirname(self.STATUS_FILE), prefix = '.tmp_', suffix = '.json', delete = False)
+            with fw_tmp:
+                json.dump(status, fw_tmp)
+            os.replace(fw_tmp.name, self.STATUS_FILE)
+        except OSError:
+            pass
+
+    def get_peak_rss(self):
+        # Bytes, (main process, worker processes)
+        peak = (None, None)
+        if resource is not None:
+            scale = 1 if sys.platform == 'darwin' else 1024 # ru_maxrss is in KB on Linux
+            peak = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+                    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+        return peak
+
+    def reset_memory_peak(self):
+        # Linux resets the peak resident size (VmHWM) of the process on demand,
+        # elsewhere the peak of a stage is the peak of the run so far
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        try:
+            with open('/proc/self/clear_refs', 'w') as fw:
+                fw.write('5')
+        except OSError:
+            pass
+
+    def get_memory_peak(self):
+        # Bytes, (resident, allocated by Python) since the last reset
+        peak_rss = None
+        try:
+            with open('/proc/self/status') as fr:
+                match = re.search(r'VmHWM:\s*(\d+) kB', fr.read())
+                peak_rss = int(match.group(1)) * 1024 if match else None
+        except OSError:
+            pass
+        if peak_rss is None:
+            peak_rss = self.get_peak_rss()[0] or 0
+        return peak_rss, tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+
+    def add_structure(self, structure, size, n_records):
+        # The biggest size seen of each structure
+        if n_records and size > self.MEMORY_STRUCTURES.get(structure, (0, 0))[0]:
+            self.MEMORY_STRUCTURES.update({structure: (int(size), n_records)})
+
+    def get_sample_size(self, values, n_values):
+        # Bytes of the n values of a container, estimated from the first ones
+        sample = list(itertools.islice(values, self.MEMORY_SAMPLE))
+        if not sample:
+            return 0
+        size = 0
+        for value in sample:
+            size += sys.getsizeof(value)
+            if isinstance(value, dict):
+                size += sum([sys.getsizeof(item) for item in value.values()])
+        return size * n_values / len(sample)
+
+    def measure_frame(self, df):
+        if self.MEMORY_PROFILE:
+            self.add_structure(self.STRUCTURE_FRAME, df.memory_usage(deep = True).sum(), len(df))
+
+    def measure_records(self, records):
+        # The records and their values, the column names are shared
+        if self.MEMORY_PROFILE:
+            self.add_structure(self.STRUCTURE_RECORDS, sys.getsizeof(records) + self.get_sample_size(records.values(), len(records)), len(records))
+
+    def measure_keys(self, structure, keys, n_records):
+        # Index of keys ({key: row} or a set), or {row: key}
+        if self.MEMORY_PROFILE:
+            values = keys.values() if isinstance(keys, dict) and structure == self.STRUCTURE_TITLE_KEYS else iter(keys)
+            self.add_structure(structure, sys.getsizeof(keys) + self.get_sample_size(values, len(keys)), n_records)
+
+    def show_memory_profile(self):
+        if self.MEMORY_PROFILE == self.MEMORY_PROFILE_TRACED:
+            self.show_print("Memory profile (peak resident, peak allocated by Python):", [self.LOG_FILE], font = self.GREEN)
+        else:
+            self.show_print("Memory profile (peak resident):", [self.LOG_FILE], font = self.GREEN)
+        for stage, (peak_rss, peak_traced) in self.MEMORY_STAGES.items():
+            message = "  %s: %.1f MB" % (stage, peak_rss / 1024 / 1024)
+            if peak_traced is not None:
+                message = "%s, %.1f MB" % (message, peak_traced / 1024 / 1024)
+            self.show_print(message, [self.LOG_FILE])
+        if self.MEMORY_STRUCTURES:
+            self.show_print("Bytes per record:", [self.LOG_FILE], font = self.GREEN)
+            for structure, (size, n_records) in self.MEMORY_STRUCTURES.items():
+                self.show_print("  %s: %s (%.1f MB, %s records)" % (structure, int(size / n_records), size / 1024 / 1024, n_records), [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
+
+    def save_metrics(self, elapsed, counts = None, n_bad = None, success = True):
+        # The totals of the run are counters (_total), the durations and
+        # sizes are gauges, all labeled by source. Written to a temporary
+        # file and renamed, the collector never reads a partial file
+        labels = 'source="%s"' % self.TYPE_FILE
+        metrics = []
+
+        def add(name, kind, description, values):
+            metrics.append("# HELP %s_%s %s" % (self.METRICS_PREFIX, name, description))
+            metrics.append("# TYPE %s_%s %s" % (self.METRICS_PREFIX, name, kind))
+            for _labels, value in values:
+                _labels = ','.join([labels] + ['%s="%s"' % item for item in _labels.items()])
+                metrics.append("%s_%s{%s} %s" % (self.METRICS_PREFIX, name, _labels, value))
+
+        add('success', 'gauge', "Whether the run finished without errors", [({}, int(success))])
+        add('last_run_timestamp_seconds', 'gauge', "End time of the run", [({}, int(time.time()))])
+        add('duration_seconds', 'gauge', "Duration of the run", [({}, round(elapsed, 3))])
+        add('stage_duration_seconds', 'gauge', "Duration of each stage of the run", [({'stage': stage.lower()}, round(seconds, 3)) for stage, seconds in self.STAGE_TIMES.items()])
+        if self.INPUT_FILE and os.path.exists(self.INPUT_FILE):
+            add('input_bytes', 'gauge', "Size of the input file", [({}, os.path.getsize(self.INPUT_FILE))])
+        if counts is not None:
+            classes = [(self.XLS_SHEET_UNIQUE, 'unique'),
+                       (self.XLS_SHEET_DUPLICATES, 'duplicate'),
+                       (self.XLS_SHEET_WITHOUT_DOI, 'without_doi')]
+            add('records_total', 'counter', "Records by class", [({'class': name}, counts[sheet_type]) for sheet_type, name in classes if sheet_type in counts])
+            add('records_input_total', 'counter', "Records read from the input file", [({}, sum(counts.values()))])
+        if n_bad is not None:
+            add('bad_lines_total', 'counter', "Malformed lines of the input file", [({}, n_bad)])
+        peak_main, peak_workers = self.get_peak_rss()
+        if peak_main is not None:
+            add('peak_rss_bytes', 'gauge', "Peak resident memory", [({'process': 'main'}, peak_main)] + ([({'process': 'workers'}, peak_workers)] if peak_workers else []))
+        if self.MEMORY_STAGES:
+            add('stage_peak_rss_bytes', 'gauge', "Peak resident memory of each stage of the run", [({'stage': stage.lower()}, peak_rss) for stage, (peak_rss, _) in self.MEMORY_STAGES.items()])
+            if self.MEMORY_PROFILE == self.MEMORY_PROFILE_TRACED:
+                add('stage_peak_traced_bytes', 'gauge', "Peak memory allocated by Python in each stage of the run", [({'stage': stage.lower()}, peak_traced) for stage, (_, peak_traced) in self.MEMORY_STAGES.items()])
+        if self.MEMORY_STRUCTURES:
+            structures = [({'structure': structure.lower().replace(' ', '_')}, size, n_records) for structure, (size, n_records) in self.MEMORY_STRUCTURES.items()]
+            add('structure_bytes', 'gauge', "Size of the main structures in memory", [(_labels, size) for _labels, size, _ in structures])
+            add('structure_bytes_per_record', 'gauge', "Size of the main structures in memory per record", [(_labels, round(size / n_records, 1)) for _labels, size, n_records in structures])
+
+        fw_tmp = tempfile.NamedTemporaryFile(mode = 'w', dir = os.path.dirname(self.METRICS_FILE), prefix = '.tmp_', suffix = '.prom', delete = False)
+        with fw_tmp:
+            fw_tmp.write('\n'.join(metrics) + '\n')
+        os.chmod(fw_tmp.name, 0o644)
+        os.replace(fw_tmp.name, self.METRICS_FILE)
+
     def create_directory(self, path):
         output = True
         try:
@@ -409,89 +1146,728 @@ class FormatInput:
         _information = ["%s: %s" % (i, j) for i, j in zip(array1, array2)]
         return " | ".join(_information)
 
-    def read_csv_with_audit(self, filepath, sep = ',', engine = None, encoding = None, return_df = True, **kwargs):
+    def detect_compression(self, file):
+        with open(file, 'rb') as fb:
+            magic = fb.read(6)
+
+        compression = None
+        for signature, _compression in self.MAGIC_NUMBERS.items():
+            if magic.startswith(signature):
+                compression = _compression
+                break
+        return compression
+
+    def open_input(self, file, binary = False, encoding = 'utf-8', errors = None):
+        # Opens plain or compressed files, the content is decompressed in a stream
+        compression = self.detect_compression(file)
+        if compression == 'gzip':
+            fb = gzip.open(file, 'rb')
+        elif compression == 'bz2':
+            fb = bz2.open(file, 'rb')
+        elif compression == 'xz':
+            fb = lzma.open(file, 'rb')
+        elif compression == 'zip':
+            archive = zipfile.ZipFile(file)
+            members = [member for member in archive.infolist() if not member.is_dir()]
+            if len(members) != 1:
+                archive.close()
+                self.show_print("  The file '%s' must contain a single file, %s found" % (os.path.basename(file), len(members)), [self.LOG_FILE], font = self.YELLOW)
+                exit()
+            fb = archive.open(members[0])
+            raw = archive.fp
+            # The archive shares its file with the member stream, the file is
+            # closed when the stream is closed
+            archive.close()
+        else:
+            fb = open(file, 'rb')
+
+        if self.PROGRESS_STATE:
+            self.PROGRESS_INPUT = ((raw if compression == 'zip' else fb).fileno(), os.path.getsize(file))
+
+        if binary:
+            return fb
+        return io.TextIOWrapper(fb, encoding = encoding, errors = errors)
+
+    def read_csv_warn(self, source, sep = ',', engine = None, encoding = None, line_offset = 0, **kwargs):
         bad_line_numbers = []
         with warnings.catch_warnings(record = True) as w:
             warnings.simplefilter('always')
-            pd.read_csv(filepath, sep = sep, engine = engine, encoding = encoding, on_bad_lines = 'warn', **kwargs)
+            df = pd.read_csv(source, sep = sep, engine = engine, encoding = encoding, on_bad_lines = 'warn', **kwargs)
 
             for warn in w:
                 msg = str(warn.message)
 
                 if 'Skipping line' in msg:
-                    match = re.search(r'Skipping line (\d+)', msg)
-                    if match:
-                        bad_line_numbers.append(int(match.group(1)))
+                    for match in re.finditer(r'Skipping line (\d+)', msg):
+                        bad_line_numbers.append(int(match.group(1)) + line_offset)
+
+        return df, bad_line_numbers
+
+    def find_csv_problem_regions(self, filepath, sep = ',', encoding = None, chunk_size = None):
+        # Scan the file with the strict csv tokenizer (C speed) and return the
+        # line/record/byte ranges of the records where the C and python engines
+        # of pandas may disagree: quoting errors or more fields than the header.
+        # With a chunk size, it also returns (byte, record) starts of records
+        # about every chunk_size bytes, right after a clean record
+        _encoding = encoding or 'utf-8'
+        regions = []
+        boundaries = []
+        header_end = 0
+        header_records = 0
+        with self.open_input(filepath, binary = True) as fb:
+            position = [0]
+
+            def decode_lines():
+                for raw in fb:
+                    position[0] += len(raw)
+                    yield raw.decode(_encoding, errors = 'replace')
+
+            reader = csv.reader(decode_lines(), delimiter = sep, strict = True)
+            n_fields = None
+            line_num = 0
+            n_records = 0
+            its_ok = True
+            while True:
+                start_byte = position[0]
+                start_line = line_num + 1
+                start_record = n_records + 1
+                try:
+                    # The short records after a quoting error can be the rest
+                    # of the record that failed
+                    record = next(reader)
+                    its_ok = n_fields is None or len(record) == n_fields or (len(record) < n_fields and its_ok)
+                except StopIteration:
+                    break
+                except csv.Error:
+                    record = None
+                    its_ok = False
 
-        bad_line_numbers = sorted(set(bad_line_numbers))
+                line_num = reader.line_num
+                n_records += 1
+                if n_fields is None:
+                    if record:
+                        n_fields = len(record)
+                        header_end = position[0]
+                        header_records = n_records
+                elif not its_ok:
+                    regions.append([start_line, line_num, start_record, n_records, start_byte, position[0]])
+                elif chunk_size and position[0] - (boundaries[-1][0] if boundaries else header_end) >= chunk_size:
+                    boundaries.append((position[0], n_records + 1))
+
+        # Merge nearby regions so that a burst of bad rows is re-parsed at once
+        merged = []
+        for region in regions:
+            if merged and region[0] - merged[-1][1] <= self.CSV_REPARSE_GAP:
+                merged[-1][1] = region[1]
+                merged[-1][3] = region[3]
+                merged[-1][5] = region[5]
+            else:
+                merged.append(region)
+
+        return header_end, header_records, position[0], merged, boundaries
+
+    def read_csv_c_first(self, filepath, sep = ',', encoding = None, shapes = None, **kwargs):
+        # Parse with the C engine and only fall back to the python engine on the
+        # problematic byte ranges. The result (rows and bad lines) is the same as
+        # parsing the whole file with engine = 'python'.
+        header_end, header_records, end_of_file, regions, _ = self.find_csv_problem_regions(filepath, sep, encoding)
+        if not regions:
+            with self.open_input(filepath, binary = True) as fb:
+                return self.read_csv_warn(fb, sep = sep, engine = 'c', encoding = encoding, **kwargs)
+
+        frames = []
+        bad_line_numbers = []
+        with self.open_input(filepath, binary = True) as fb:
+            header_bytes = fb.read(header_end)
+
+            def parse_segment(segment, **kwargs_segment):
+                if self.REPAIR_ROWS:
+                    return self.read_csv_repaired(fb, header_bytes, segment, sep = sep, encoding = encoding, shapes = shapes, **kwargs_segment)
+                return self.read_csv_segment(fb, header_bytes, header_records, segment, sep = sep, encoding = encoding, **kwargs_segment)
+
+            segments = self.get_csv_segments(header_end, header_records, end_of_file, regions)
+            if self.REPAIR_ROWS:
+                # The repaired regions are well-formed, the segments are parsed together
+                segments = self.group_csv_segments(segments, self.CSV_CHUNK_SIZE)
+
+            for segment in segments:
+                _df, _bad = parse_segment(segment, **kwargs)
+                frames.append(_df)
+                bad_line_numbers.extend(_bad)
+
+            # Segments without rows carry no dtype information
+            parsed = [(segment, _df) for segment, _df in zip(segments, frames) if len(_df) > 0]
+            if not parsed:
+                return frames[0], bad_line_numbers
+
+            # A column that is text in any segment is text for the whole file,
+            # re-read it as text where it was inferred as numeric
+            text_columns = [column for column in parsed[0][1].columns if any(pd.api.types.is_string_dtype(_df[column]) or _df[column].dtype == object for _, _df in parsed)]
+            frames = []
+            for segment, _df in parsed:
+                numeric = [column for column in text_columns if column in _df.columns and pd.api.types.is_numeric_dtype(_df[column])]
+                if numeric:
+                    _kwargs = dict(kwargs)
+                    _kwargs['dtype'] = dict(kwargs.get('dtype') or {}, **{column: str for column in numeric})
+                    _df, _ = parse_segment(segment, **_kwargs)
+                frames.append(_df)
+
+        df = pd.concat(frames, ignore_index = True)
+
+        return df, bad_line_numbers
+
+    def get_csv_projection(self, filepath, sep = ',', encoding = None, columns = None, dtypes = None):
+        # usecols and dtype arguments of pandas for the given columns
+        projection = {'usecols': self.get_csv_usecols(filepath, sep, encoding, columns)}
+        if dtypes:
+            projection['dtype'] = {column: dtypes[column.strip()] for column in projection['usecols'] if column.strip() in dtypes}
+        return projection
+
+    def get_csv_usecols(self, filepath, sep = ',', encoding = None, columns = None):
+        # Names of the columns as they are in the header of the file, the
+        # missing ones are reported by the caller
+        _encoding = encoding or 'utf-8'
+        if _encoding.lower().replace('_', '-') == 'utf-8':
+            _encoding = 'utf-8-sig' # Same as pandas, without the BOM
+
+        header = []
+        with self.open_input(filepath, encoding = _encoding, errors = 'replace') as fr:
+            for record in csv.reader(fr, delimiter = sep):
+                if record:
+                    header = record
+                    break
+
+        columns = set(columns or [])
+        return list(dict.fromkeys([column for column in header if column.strip() in columns]))
+
+    def get_csv_segments(self, header_end, header_records, end_of_file, regions):
+        # (start byte, end byte, start record, engine) of the clean ranges and
+        # of the problem regions of a file, in order
+        segments = []
+        clean_byte = header_end
+        clean_record = header_records + 1
+        for _, _, start_record, end_record, start_byte, end_byte in regions:
+            segments.append((clean_byte, start_byte, clean_record, 'c'))
+            segments.append((start_byte, end_byte, start_record, 'python'))
+            clean_byte = end_byte
+            clean_record = end_record + 1
+        segments.append((clean_byte, end_of_file, clean_record, 'c'))
+        segments = [segment for segment in segments if segment[1] > segment[0]]
+        return segments
+
+    def read_csv_segment(self, fb, header_bytes, header_records, segment, sep = ',', encoding = None, **kwargs):
+        # Compressed streams only seek forward efficiently, segments are read in order
+        start_byte, end_byte, start_record, engine = segment
+        fb.seek(start_byte)
+        data = io.BytesIO(header_bytes + fb.read(end_byte - start_byte))
+        # The python engine reports bad lines by record number, the
+        # header records are repeated at the start of every segment
+        return self.read_csv_warn(data, sep = sep, engine = engine, encoding = encoding, line_offset = start_record - header_records - 1, **kwargs)
+
+    def read_csv_repaired(self, fb, header_bytes, segments, sep = ',', encoding = None, shapes = None, **kwargs):
+        # Consecutive segments parsed at once with the C engine, the problem
+        # regions are repaired first. The repair of a row is in an extra last
+        # field, the CSV_REPAIRED column (empty for the other rows), and the
+        # rows that couldn't be repaired are bad lines
+        _encoding = encoding or 'utf-8'
+        data = [header_bytes.rstrip(b'\r\n') + ("%s%s\n" % (sep, self.CSV_REPAIRED)).encode(_encoding)]
+        bad_line_numbers = []
+        for start_byte, end_byte, start_record, engine in segments:
+            fb.seek(start_byte)
+            if engine == 'python':
+                repaired, bad_records = self.repair_csv_rows(header_bytes, fb.read(end_byte - start_byte), sep, encoding, shapes)
+                data.append(repaired)
+                bad_line_numbers.extend([start_record + record for record in bad_records])
+            else:
+                data.append(fb.read(end_byte - start_byte))
+
+        if kwargs.get('usecols') is not None:
+            kwargs['usecols'] = list(kwargs['usecols']) + [self.CSV_REPAIRED]
+        kwargs['dtype'] = dict(kwargs.get('dtype') or {}, **{self.CSV_REPAIRED: str})
+        df, _ = self.read_csv_warn(io.BytesIO(b''.join(data)), sep = sep, engine = 'c', encoding = encoding, **kwargs)
+        return df, bad_line_numbers
+
+    def repair_csv_rows(self, header_bytes, data, sep = ',', encoding = None, shapes = None):
+        # Rows of a problem region written again as well-formed csv, with the
+        # repair in an extra field of the rows that needed one, and the record
+        # numbers (from 0) of the rows that couldn't be repaired. The records
+        # are found by the strict csv reader, a line that doesn't start a
+        # record that fits the shapes ({column: pattern}) of the schema is
+        # read on its own: a quote that isn't closed on the line is dropped,
+        # the other quoting faults are read like the python engine does. The
+        # fields of a separator that wasn't quoted are joined in a column
+        # without a shape. A repair is kept only if the row has the fields of
+        # the header and fits the shapes, the other rows are bad lines
+        _encoding = encoding or 'utf-8'
+        header = [record for record in csv.reader(io.StringIO(header_bytes.decode(_encoding, errors = 'replace'), newline = ''), delimiter = sep) if record]
+        names = [name.strip() for name in header[-1]] if header else []
+        n_fields = len(names)
+        lines = io.StringIO(data.decode(_encoding, errors = 'replace'), newline = '').readlines()
+        hints = [(shapes or {}).get(name) for name in names]
+
+        # Shape and mean length of the columns in a sample of the lines that
+        # are whole records
+        sample = []
+        for line in lines:
+            if len(sample) >= self.CSV_SHAPE_SAMPLE:
+                break
+            try:
+                fields = next(csv.reader([line], delimiter = sep, strict = True), [])
+            except csv.Error:
+                continue
+            if len(fields) == n_fields and self.fit_csv_shapes(fields, hints):
+                sample.append(fields)
+        _shapes = []
+        lengths = []
+        for column in range(n_fields):
+            values = [fields[column].strip() for fields in sample if fields[column].strip()]
+            shape = hints[column]
+            for pattern in self.CSV_SHAPES:
+                if shape is None and values and sum([1 for value in values if pattern.search(value)]) >= self.CSV_SHAPE_RATIO * len(values):
+                    shape = pattern
+            _shapes.append(shape)
+            lengths.append(sum([len(value) for value in values]) / len(values) if values else 0)
+
+        fw = io.StringIO()
+        writer = csv.writer(fw, delimiter = sep, lineterminator = '\n')
+        bad_records = []
+        n_records = 0
+        i = 0
+        while i < len(lines):
+            try:
+                fields, end = self.read_csv_record(lines, i, sep, strict = True)
+            except csv.Error:
+                fields, end = None, i + 1
+            repair = None
+            if fields is not None and len(fields) > n_fields:
+                fields = self.merge_csv_fields(fields, n_fields, sep, _shapes, lengths, hints)
+                repair = self.CSV_REPAIR_FIELDS
+            if fields is None or not self.fit_csv_shapes(fields, hints):
+                # A quoting fault, or a record that took the next lines or
+                # doesn't fit: the line is read on its own
+                fields, repair = self.read_csv_line(lines[i], n_fields, sep, _shapes, lengths, hints)
+                end = i + 1
+
+            if fields is None:
+                bad_records.append(n_records)
+            elif fields:
+                writer.writerow(fields + [repair] if repair else fields)
+            n_records += 1
+            i = end
+
+        return fw.getvalue().encode(_encoding, errors = 'replace'), bad_records
+
+    def read_csv_line(self, line, n_fields, sep, shapes, lengths, hints):
+        # (fields, repair) of a line read on its own, without the quote that
+        # opens a field and is never closed. The fields are None if the line
+        # isn't a whole record that fits the shapes of the schema
+        text = self.close_csv_quote(line, sep)
+        repair = self.CSV_REPAIR_STRAY if text is None else self.CSV_REPAIR_QUOTE
+        fields = next(csv.reader([text or line], delimiter = sep), [])
+        if len(fields) > n_fields:
+            fields = self.merge_csv_fields(fields, n_fields, sep, shapes, lengths, hints)
+        if fields is None or len(fields) != n_fields or not self.fit_csv_shapes(fields, hints):
+            return None, repair
+        return fields, repair
+
+    def iter_csv_lines(self, lines, position):
+        # Lines from a position that the caller can move
+        while position[0] < len(lines):
+            position[0] += 1
+            yield lines[position[0] - 1]
+
+    def read_csv_record(self, lines, start, sep = ',', strict = False):
+        # Fields of the record that starts at a line and the line after it
+        position = [start]
+        fields = next(csv.reader(self.iter_csv_lines(lines, position), delimiter = sep, strict = strict), [''])
+        return fields, position[0]
+
+    def fit_csv_shapes(self, fields, shapes):
+        # The fields have the shapes of their columns (None for any value)
+        return all([shape is None or not value.strip() or shape.search(value.strip()) for value, shape in zip(fields, shapes)])
+
+    def close_csv_quote(self, text, sep = ','):
+        # The text without the quote that opens a field and is never closed,
+        # None if every quoted field is closed. Same states as the csv module
+        start, in_field, in_quotes, quote_in_quotes = range(4)
+        state = start
+        opening = None
+        for position, char in enumerate(text):
+            if state == in_quotes:
+                if char == '"':
+                    state = quote_in_quotes
+            elif state == quote_in_quotes and char == '"':
+                state = in_quotes
+            elif char == sep or char in '\r\n':
+                state = start
+            elif state == start and char == '"':
+                state = in_quotes
+                opening = position
+            else:
+                state = in_field
+
+        if state != in_quotes:
+            return None
+        return text[:opening] + text[opening + 1:]
+
+    def merge_csv_fields(self, fields, n_fields, sep, shapes, lengths, hints):
+        # The extra fields are joined in one column without a shape, but not
+        # in the last one (they can't be told from fields past the end of the
+        # row). The other columns must fit the shapes of the schema (hints),
+        # and a number or a DOI can't be in a column without a shape or be
+        # joined in one. The column that leaves most fields with the shape of
+        # their column, then the longest column, then the last one. None if
+        # no column fits
+        extra = len(fields) - n_fields
+        best = None
+        for start in range(n_fields - 1):
+            if shapes[start] is not None:
+                continue
+            merged = fields[:start] + [sep.join(fields[start:start + extra + 1])] + fields[start + extra + 1:]
+            if not self.fit_csv_shapes(merged, hints):
+                continue
+            text = fields[start:start + extra + 1] + [value for column, (value, shape) in enumerate(zip(merged, shapes)) if shape is None and column != start]
+            if any([pattern.search(value.strip()) for value in text for pattern in self.CSV_SHAPES]):
+                continue
+            score = sum([1 for value, shape in zip(merged, shapes) if shape is None or not value.strip() or shape.search(value.strip())])
+            if best is None or (score, lengths[start]) >= best[0]:
+                best = ((score, lengths[start]), merged)
+        return best[1] if best else None
+
+    def read_csv_arrow(self, filepath, sep = ',', encoding = None, **kwargs):
+        # Multithreaded parsing, only for well-formed files: any parsing error
+        # returns None so that the caller uses the audited parsers instead.
+        if pyarrow is None:
+            self.show_print("  Arrow engine not available (pyarrow isn't installed), using the '%s' engine" % self.ENGINE_AUTO, [self.LOG_FILE], font = self.YELLOW)
+            return None
+
+        # pyarrow accepts an unclosed quote and folds the next records in one
+        # field without any error, the file is checked with the strict tokenizer first
+        regions = self.find_csv_problem_regions(filepath, sep, encoding)[3]
+        if regions:
+            self.show_print("  Arrow engine can't parse the file (%s malformed region(s), first at line %s), using the '%s' engine" % (len(regions), regions[0][0], self.ENGINE_AUTO), [self.LOG_FILE], font = self.YELLOW)
+            return None
+
+        # The pyarrow engine doesn't support index_col = False, which is its default behavior
+        if kwargs.get('index_col') is False:
+            kwargs.pop('index_col')
 
         df = None
-        if return_df:
-            df = pd.read_csv(filepath, sep = sep, engine = engine, encoding = encoding, on_bad_lines = 'skip', **kwargs)
+        try:
+            with self.open_input(filepath, binary = True) as fb:
+                df = pd.read_csv(fb, sep = sep, engine = 'pyarrow', encoding = encoding, **kwargs)
+        except Exception as e:
+            message = str(e).strip().split('\n')[0]
+            self.show_print("  Arrow engine couldn't parse the file (%s), using the '%s' engine" % (message, self.ENGINE_AUTO), [self.LOG_FILE], font = self.YELLOW)
+
+        return df
+
+    def read_csv_with_audit(self, filepath, sep = ',', engine = None, encoding = None, return_df = True, columns = None, dtypes = None, shapes = None, **kwargs):
+        # Only the given columns (stripped names) are parsed, if any, with
+        # their dtypes (by stripped name too). The shapes of the columns
+        # ({column: pattern}) guide the repair of the malformed rows
+        if columns is not None:
+            kwargs.update(self.get_csv_projection(filepath, sep, encoding, columns, dtypes))
+
+        df = None
+        bad_line_numbers = []
+        if self.ENGINE == self.ENGINE_ARROW:
+            df = self.read_csv_arrow(filepath, sep = sep, encoding = encoding, **kwargs)
+
+        if df is None:
+            if engine == 'python' and self.ENGINE != self.ENGINE_PYTHON:
+                df, bad_line_numbers = self.read_csv_c_first(filepath, sep = sep, encoding = encoding, shapes = shapes, **kwargs)
+            else:
+                if kwargs.get('usecols') is not None and engine != 'python' and self.find_csv_problem_regions(filepath, sep, encoding)[3]:
+                    # The C engine doesn't report the rows with more fields than
+                    # the header when it skips columns, those files are parsed whole
+                    kwargs.pop('usecols')
+                with self.open_input(filepath, binary = True) as fb:
+                    df, bad_line_numbers = self.read_csv_warn(fb, sep = sep, engine = engine, encoding = encoding, **kwargs)
+
+        if not return_df:
+            df = None
+
+        bad_lines = self.get_bad_lines(filepath, encoding, bad_line_numbers)
+
+        return df, bad_lines
+
+    def get_bad_lines(self, filepath, encoding, bad_line_numbers):
+        bad_line_numbers = sorted(set(bad_line_numbers))
 
         bad_lines = []
         if bad_line_numbers:
             bad_set = set(bad_line_numbers)
 
-            with open(filepath, encoding = encoding or 'utf-8', errors = 'replace') as fr:
+            with self.open_input(filepath, encoding = encoding or 'utf-8', errors = 'replace') as fr:
                 for i, line in enumerate(fr, start = 1):
                     if i in bad_set:
                         bad_lines.append({'line_number': i,
                                           'raw': line.rstrip('\n')})
 
-        return df, bad_lines
+        return bad_lines
 
     def read_txt_file(self):
-        content = open(self.INPUT_FILE, 'r').readlines()
+        # The DOI list is streamed: the records are yielded to the writer as
+        # they are read, only the keys seen so far are kept in memory
+        if self.PIPELINE:
+            return self.read_pipeline()
 
-        collect_unique = {}
-        collect_duplicate_doi = {}
-        nr_doi = []
-        index = 1
-        for idx, line in enumerate(content, start = 1):
-            line = line.strip()
-            if line != '':
-                flag_unique = False
-                doi = line.lower()
-                if doi not in nr_doi:
-                    nr_doi.append(doi)
-                    flag_unique = True
-
-                collect = {}
-                collect[self.xls_col_doi] = doi
+        bad_lines = []
+        collect_papers = {self.STREAM_RECORDS: self.iter_txt_records(bad_lines),
+                          'bad': bad_lines}
 
-                if flag_unique:
-                    collect_unique.update({index: collect})
-                    index += 1
+        return collect_papers
+
+    def iter_txt_keys(self):
+        # (key, line number, line) of the non-empty lines, by chunks of the file
+        with self.open_input(self.INPUT_FILE) as fr:
+            lines = ((idx, line.strip()) for idx, line in enumerate(fr, start = 1))
+            lines = ((idx, line) for idx, line in lines if line)
+            while True:
+                chunk = list(itertools.islice(lines, self.DEDUP_CHUNK))
+                if not chunk:
+                    break
+
+                if self.CANONICALIZE_DOI:
+                    keys = self.extract_dois(pd.Series([line for _, line in chunk], dtype = object)).fillna('').tolist()
                 else:
-                    collect[self.xls_col_duplicate_type] = self.xls_val_by_doi
-                    collect_duplicate_doi.update({idx: collect})
+                    keys = [line.lower() for _, line in chunk]
 
-        collect_papers = {self.XLS_SHEET_UNIQUE: collect_unique,
-                          self.XLS_SHEET_DUPLICATES: collect_duplicate_doi}
+                for (idx, line), key in zip(chunk, keys):
+                    yield key, idx, line
 
-        return collect_papers
+    def iter_txt_records(self, bad_lines):
+        # (sheet type, index, record) of the DOI list, in order
+        duplicates = None
+        if self.MAX_MEMORY:
+            # The duplicates are resolved within the memory budget first
+            with self.open_input(self.INPUT_FILE) as fr:
+                n_lines = sum(1 for _ in fr)
+            duplicates = self.find_first_seen(((key, idx) for key, idx, _ in self.iter_txt_keys()), n_lines)
+
+        seen = set()
+        index = 1
+        for key, idx, line in self.iter_txt_keys():
+            if not key:
+                bad_lines.append({'line_number': idx,
+                                  'raw': line})
+                continue
+
+            if duplicates is None:
+                flag_unique = key not in seen
+                seen.add(key)
+            else:
+                flag_unique = idx not in duplicates
+
+            collect = {}
+            collect[self.xls_col_doi] = key
+
+            if flag_unique:
+                yield self.XLS_SHEET_UNIQUE, index, collect
+                index += 1
+            else:
+                collect[self.xls_col_duplicate_type] = self.xls_val_by_doi
+                yield self.XLS_SHEET_DUPLICATES, idx, collect
 
     def read_csv_file(self):
+        # Repeated runs over the same input skip the parsing
+        cache_file = None
+        if self.CACHE_DIR:
+            cache_file = self.get_cache_file()
+            cached = self.load_cache(cache_file)
+            if cached is not None:
+                records, bad_lines = cached
+                return self.classify_records(records, bad_lines)
 
-        def check_columns(df, file_name, arr_columns):
-            its_ok = True
-            for column in arr_columns:
-                if column not in df.columns:
-                    self.show_print("  Column '%s' don't exist, please check file '%s'" % (column, os.path.basename(file_name)), [self.LOG_FILE], font = self.YELLOW)
-                    its_ok = False
+        if self.PIPELINE:
+            return self.read_pipeline()
 
-            if not its_ok:
-                exit()
+        self.progress_start(self.STAGE_READING, 'MB', poll = self.poll_input)
 
-        use_temporary = False
-        _input_file_tmp = ''
+        if self.is_ris_input():
+            records, bad_lines = self.read_ris_file(self.INPUT_FILE)
 
-        _input_file = self.INPUT_FILE
+            if cache_file:
+                self.save_cache(cache_file, records, bad_lines)
+
+            return self.classify_records(records, bad_lines)
+
+        schema = self.get_csv_schema()
+        try:
+            if self.is_csv_parallel(schema):
+                records, bad_lines, recovered = self.read_csv_parallel(schema)
+            else:
+                records, bad_lines, recovered = self.read_csv_records(schema)
+        finally:
+            self.remove_converted_input(schema)
+
+        if recovered:
+            self.show_print("  DOIs found in other columns: %s" % recovered, [self.LOG_FILE])
+        if self.REPAIR_ROWS:
+            self.show_print("  Repaired rows: %s" % self.count_repaired(records), [self.LOG_FILE])
+
+        if cache_file:
+            self.save_cache(cache_file, records, bad_lines)
+
+        return self.classify_records(records, bad_lines)
+
+    def remove_converted_input(self, schema):
+        # The temporary csv file of the sources that are converted first
+        # (PubMed Central, Dimensions, Embase)
+        if schema['file'] != self.INPUT_FILE and os.path.exists(schema['file']):
+            os.remove(schema['file'])
+
+    def is_ris_input(self):
+        return self.TYPE_FILE == self.TYPE_SCIENCEDIRECT or (self.TYPE_FILE in self.ARRAY_TYPE_RIS and self.is_ris_file(self.INPUT_FILE))
+
+    def read_csv_records(self, schema):
+        df, bad_lines = self.read_csv_with_audit(schema['file'], sep = schema['separator'], header = 0, index_col = False, engine = schema['engine'], columns = schema['columns'], dtypes = schema['dtypes'], shapes = schema['shapes'])
+        df.columns = df.columns.str.strip()
+        self.measure_frame(df)
+
+        # Check columns
+        self.check_columns(df.columns, schema['file'], schema['required'])
+
+        self.progress_start(self.STAGE_NORMALIZING, 'records', total = len(df))
+        records, recovered = self.normalize_frame(df, schema)
+
+        return records, bad_lines, recovered
+
+    def read_pipeline(self):
+        # The input is read, normalized, classified and written at the same
+        # time: the reader and the classifier run in threads connected to the
+        # writer by queues of at most PIPELINE_QUEUE_SIZE batches, so only a
+        # few batches of records are in memory at once
+        bad_lines = []
+        if self.TYPE_FILE == self.TYPE_TXT:
+            batches = self.iter_chunks(self.iter_txt_records(bad_lines), self.DEDUP_CHUNK)
+        else:
+            if self.is_ris_input():
+                batches = self.iter_ris_batches(self.INPUT_FILE, bad_lines)
+            else:
+                batches = self.iter_csv_batches(self.get_csv_schema(), bad_lines)
+            batches = self.classify_stream(self.iter_pipeline(batches))
+
+        collect_papers = {self.STREAM_RECORDS: itertools.chain.from_iterable(self.iter_pipeline(batches)),
+                          'bad': bad_lines}
+
+        return collect_papers
+
+    def iter_pipeline(self, iterable):
+        # The iterable runs in a thread, ahead of the consumer by at most
+        # PIPELINE_QUEUE_SIZE items. Its exceptions (exit() too) are raised
+        # again in the consumer
+        items = queue.Queue(maxsize = self.PIPELINE_QUEUE_SIZE)
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for item in iterable:
+                    items.put((True, item))
+                    if stop.is_set():
+                        return
+                items.put((False, None))
+            except BaseException as e:
+                items.put((False, e))
+
+        thread = threading.Thread(target = produce, daemon = True)
+        thread.start()
+        try:
+            while True:
+                its_item, item = items.get()
+                if not its_item:
+                    if item is not None:
+                        raise item
+                    break
+                yield item
+        finally:
+            # A consumer that stops early releases the producer
+            stop.set()
+            while thread.is_alive():
+                try:
+                    items.get(timeout = 0.1)
+                except queue.Empty:
+                    pass
+
+    def iter_chunks(self, iterable, size):
+        iterable = iter(iterable)
+        while True:
+            chunk = list(itertools.islice(iterable, size))
+            if not chunk:
+                break
+            yield chunk
+
+    def iter_csv_batches(self, schema, bad_lines):
+        # Batches of records ({row: record}) of a csv file, in order. The file
+        # is parsed by chunks of about PIPELINE_CHUNK_SIZE bytes with the same
+        # segments as the parallel parsing, except for the engines that read
+        # the whole file (Web of Science, --engine python or arrow). The
+        # converted input is removed at the end
+        try:
+            file = schema['file']
+            separator = schema['separator']
+            repaired = 0
+            if schema['engine'] != 'python' or self.ENGINE != self.ENGINE_AUTO:
+                records, _bad_lines, recovered = self.read_csv_records(schema)
+                bad_lines.extend(_bad_lines)
+                repaired = self.count_repaired(records)
+                for rows in self.iter_chunks(list(records.keys()), self.DEDUP_CHUNK):
+                    yield {row: records.pop(row) for row in rows}
+            else:
+                projection = self.get_csv_projection(file, separator, None, schema['columns'], schema['dtypes'])
+                self.check_columns([column.strip() for column in projection['usecols']], file, schema['required'])
+                header_end, header_records, chunks = self.get_csv_chunks(file, separator, self.PIPELINE_CHUNK_SIZE)
+
+                kwargs = dict(projection, header = 0, index_col = False)
+                bad_line_numbers = []
+                recovered = 0
+                offset = 0
+                with self.open_input(file, binary = True) as fb:
+                    header_bytes = fb.read(header_end)
+                    for chunk in chunks:
+                        _records, _bad_line_numbers, _recovered = self.parse_csv_chunk(fb, header_bytes, header_records, chunk, schema, kwargs)
+                        records = {}
+                        for row, collect in _records.items():
+                            collect[self.xls_col_row] = row + offset
+                            records.update({row + offset: collect})
+                        offset += len(records)
+                        bad_line_numbers.extend(_bad_line_numbers)
+                        recovered += _recovered
+                        repaired += self.count_repaired(records)
+                        yield records
+
+                bad_lines.extend(self.get_bad_lines(file, None, bad_line_numbers))
+        finally:
+            self.remove_converted_input(schema)
+
+        if recovered:
+            self.show_print("  DOIs found in other columns: %s" % recovered, [self.LOG_FILE])
+        if self.REPAIR_ROWS:
+            self.show_print("  Repaired rows: %s" % repaired, [self.LOG_FILE])
+
+    def count_repaired(self, records):
+        return sum([1 for record in records.values() if record.get(self.xls_col_repaired)])
+
+    def check_columns(self, columns, file_name, arr_columns):
+        its_ok = True
+        for column in arr_columns:
+            if column not in columns:
+                self.show_print("  Column '%s' don't exist, please check file '%s'" % (column, os.path.basename(file_name)), [self.LOG_FILE], font = self.YELLOW)
+                its_ok = False
+
+        if not its_ok:
+            exit()
+
+    def get_csv_columns(self):
+        # Columns of the source, without reading the input file
+        _cols_doi_fallback = [] # Other columns that can have the DOI (optional)
         if self.TYPE_FILE == self.TYPE_SCOPUS:
             separator = ','
             _col_doi = self.scopus_col_doi
             _col_year = self.scopus_col_year
+            _col_cited_by = self.scopus_col_cited_by
+            _cols_category = [self.scopus_col_document_type, self.scopus_col_language]
 
             arr_columns = [self.scopus_col_authors,
                            self.scopus_col_title,
@@ -504,7 +1880,10 @@ class FormatInput:
         elif self.TYPE_FILE in [self.TYPE_WOS, self.TYPE_SCIELO]:
             separator = '\t'
             _col_doi = self.wos_col_doi
+            _cols_doi_fallback = [self.wos_col_book_doi]
             _col_year = self.wos_col_year
+            _col_cited_by = self.wos_col_cited_by
+            _cols_category = [self.wos_col_document_type, self.wos_col_language]
 
             arr_columns = [self.wos_col_authors,
                            self.wos_col_title,
@@ -517,17 +1896,21 @@ class FormatInput:
         elif self.TYPE_FILE == self.TYPE_PUBMED:
             separator = ','
             _col_doi = self.pubmed_col_doi
+            _cols_doi_fallback = [self.pubmed_col_citation]
             _col_year = self.pubmed_col_year
+            _col_cited_by = self.pubmed_col_cited_by
+            _cols_category = [self.pubmed_col_document_type, self.pubmed_col_language]
 
             arr_columns = [self.pubmed_col_authors,
                            self.pubmed_col_title,
                            self.pubmed_col_year,
                            self.pubmed_col_doi]
         elif self.TYPE_FILE == self.TYPE_PUBMED_CENTRAL:
-            _input_file = self.read_medline_file(_input_file)
             separator = ','
             _col_doi = self.pmc_col_doi
             _col_year = self.pmc_col_year
+            _col_cited_by = self.pmc_col_cited_by
+            _cols_category = [self.pmc_col_document_type, self.pmc_col_language]
 
             arr_columns = [self.pmc_col_authors,
                            self.pmc_col_title,
@@ -537,10 +1920,11 @@ class FormatInput:
                            self.pmc_col_document_type,
                            self.pmc_col_language]
         elif self.TYPE_FILE == self.TYPE_DIMENSIONS:
-            _input_file = self.read_dimensions_file(_input_file)
             separator = ','
             _col_doi = self.dimensions_col_doi
             _col_year = self.dimensions_col_year
+            _col_cited_by = self.dimensions_col_cited_by
+            _cols_category = [self.dimensions_col_document_type, self.dimensions_col_language]
 
             arr_columns = [self.dimensions_col_authors,
                            self.dimensions_col_title,
@@ -551,7 +1935,10 @@ class FormatInput:
         elif self.TYPE_FILE == self.TYPE_GOOGLE_SCHOLAR:
             separator = ','
             _col_doi = self.scholar_col_doi
+            _cols_doi_fallback = [self.scholar_col_article_url, self.scholar_col_full_text_url]
             _col_year = self.scholar_col_year
+            _col_cited_by = self.scholar_col_cited_by
+            _cols_category = [self.scholar_col_document_type, self.scholar_col_language]
 
             arr_columns = [self.scholar_col_authors,
                            self.scholar_col_title,
@@ -562,6 +1949,8 @@ class FormatInput:
             separator = ','
             _col_doi = self.cochrane_col_doi
             _col_year = self.cochrane_col_year
+            _col_cited_by = self.cochrane_col_cited_by
+            _cols_category = [self.cochrane_col_document_type, self.cochrane_col_language]
 
             arr_columns = [self.cochrane_col_authors,
                            self.cochrane_col_title,
@@ -569,10 +1958,12 @@ class FormatInput:
                            self.cochrane_col_year,
                            self.cochrane_col_doi]
         elif self.TYPE_FILE == self.TYPE_EMBASE:
-            _input_file = self.read_embase_file(_input_file)
             separator = ','
             _col_doi = self.embase_col_doi
+            _cols_doi_fallback = [self.embase_col_full_text_link]
             _col_year = self.embase_col_year
+            _col_cited_by = self.embase_col_cited_by
+            _cols_category = [self.embase_col_document_type, self.embase_col_language]
 
             arr_columns = [self.embase_col_authors,
                            self.embase_col_title,
@@ -581,21 +1972,12 @@ class FormatInput:
                            self.embase_col_doi,
                            self.embase_col_document_type,
                            self.embase_col_language]
-        elif self.TYPE_FILE == self.TYPE_SCIENCEDIRECT:
-            _input_file = self.read_sciencedirect_file(_input_file)
-            separator = '|'
-            _col_doi = self.sciencedirect_col_doi
-            _col_year = self.sciencedirect_col_year
-
-            arr_columns = [self.sciencedirect_col_authors,
-                           self.sciencedirect_col_title,
-                           self.sciencedirect_col_abstract,
-                           self.sciencedirect_col_year,
-                           self.sciencedirect_col_doi]
         elif self.TYPE_FILE == self.TYPE_IEEE:
             separator = ','
             _col_doi = self.ieee_col_doi
             _col_year = self.ieee_col_year
+            _col_cited_by = self.ieee_col_cited_by
+            _cols_category = [self.ieee_col_document_type, self.ieee_col_language]
 
             arr_columns = [self.ieee_col_authors,
                            self.ieee_col_title,
@@ -606,6 +1988,8 @@ class FormatInput:
             separator = ','
             _col_doi = self.bvs_col_doi
             _col_year = self.bvs_col_year
+            _col_cited_by = self.bvs_col_cited_by
+            _cols_category = [self.bvs_col_document_type, self.bvs_col_language]
 
             arr_columns = [self.bvs_col_authors,
                            self.bvs_col_title,
@@ -618,6 +2002,8 @@ class FormatInput:
             separator = ','
             _col_doi = self.cab_col_doi
             _col_year = self.cab_col_year
+            _col_cited_by = self.cab_col_cited_by
+            _cols_category = [self.cab_col_document_type, self.cab_col_language]
 
             arr_columns = [self.cab_col_authors,
                            self.cab_col_title,
@@ -626,59 +2012,86 @@ class FormatInput:
                            self.cab_col_doi,
                            self.cab_col_language]
 
-        if self.TYPE_FILE in [self.TYPE_WOS]:
-            df, bad_lines = self.read_csv_with_audit(_input_file, sep = separator, header = 0, index_col = False)
-        else:
-            df, bad_lines = self.read_csv_with_audit(_input_file, sep = separator, header = 0, index_col = False, engine = 'python')
 
-        df = df.replace({np.nan: ''})
-        df.columns = df.columns.str.strip()
-        # print(df)
+        return {'separator': separator,
+                'required': arr_columns,
+                'doi': _col_doi,
+                'doi_fallback': _cols_doi_fallback,
+                'year': _col_year,
+                'cited_by': _col_cited_by,
+                'category': _cols_category}
 
-        # Check columns
-        check_columns(df, _input_file, arr_columns)
+    def get_csv_schema(self):
+        # Columns of the source and how they are parsed, the sources that are
+        # converted to csv first are converted here
+        _input_file = self.INPUT_FILE
+        if self.TYPE_FILE == self.TYPE_PUBMED_CENTRAL:
+            self.progress_start(self.STAGE_CONVERTING, 'MB', poll = self.poll_input)
+            _input_file = self.read_medline_file(_input_file)
+            self.progress_start(self.STAGE_READING, 'MB', poll = self.poll_input)
+        elif self.TYPE_FILE == self.TYPE_DIMENSIONS:
+            _input_file = self.read_dimensions_file(_input_file)
+        elif self.TYPE_FILE == self.TYPE_EMBASE:
+            _input_file = self.read_embase_file(_input_file)
 
-        # Get DOIs
-        collect_unique_doi = {}
-        collect_duplicate_doi = {}
-        collect_without_doi = {}
-        nr_doi = []
-        for idx, row in df.iterrows():
-            flag_unique = False
-            flag_duplicate_doi = False
-            flag_without_doi = False
-
-            doi = row[_col_doi]
-            doi = doi.strip()
-            if doi:
-                doi = doi.lower()
-                doi = doi[:-1] if doi.endswith('.') else doi
-
-                if 'doi.org' in doi:
-                    doi = doi.split('.org/')[1]
-
-                pattern = re.compile(r'^10\.')
-                if pattern.match(doi):
-                    if doi not in nr_doi:
-                        nr_doi.append(doi)
-                        flag_unique = True
-                    else:
-                        flag_duplicate_doi = True
-                else:
-                    doi = ''
-                    flag_without_doi = True
-            else:
-                flag_without_doi = True
+        source = self.get_csv_columns()
+        arr_columns = source['required'] + self.EXTRA_COLUMNS
+        columns = arr_columns + source['doi_fallback']
+
+        # Typed schema: text, categories for the repeated values, and the
+        # numbers are parsed as text and converted below
+        dtypes = {column: self.DTYPE_TEXT for column in columns}
+        dtypes.update({column: self.DTYPE_CATEGORY for column in source['category'] if column})
+        shapes = {source['year']: self.CSV_SHAPE_YEAR, source['doi']: self.CSV_SHAPE_DOI, source['cited_by']: self.CSV_SHAPE_NUMBER}
+
+        schema = {'file': _input_file,
+                  'separator': source['separator'],
+                  'engine': None if self.TYPE_FILE in [self.TYPE_WOS] else 'python',
+                  'required': arr_columns,
+                  'columns': columns,
+                  'dtypes': dtypes,
+                  'shapes': {column: shape for column, shape in shapes.items() if column},
+                  'doi': [source['doi']] + source['doi_fallback'],
+                  'year': source['year'],
+                  'cited_by': source['cited_by'],
+                  'category': source['category']}
+
+        return schema
+
+    def normalize_frame(self, df, schema):
+        # Records of a parsed frame, {row: record} with rows from 1, and the
+        # number of DOIs found in the fallback columns
+        columns = schema['columns']
+        _col_year = schema['year']
+        _col_cited_by = schema['cited_by']
+
+        # The segments of a file can have different categories. The source
+        # transforms of a category column run once per distinct value
+        transforms = {}
+        if self.TYPE_FILE in [self.TYPE_WOS, self.TYPE_SCIELO]:
+            transforms = {self.wos_col_document_type: self.format_publication_type}
+        elif self.TYPE_FILE == self.TYPE_BVS:
+            transforms = {self.bvs_col_document_type: str.capitalize,
+                          self.bvs_col_language: self.get_language}
+        categories = {}
+        for column in schema['category']:
+            if column in df.columns:
+                df[column] = df[column].astype(self.DTYPE_CATEGORY)
+                categories[column] = self.get_category_values(df[column], transforms.get(column, str.strip))
+        df[_col_year] = self.get_integers(df[_col_year], self.YEAR_PATTERN)
+        if _col_cited_by in df.columns:
+            df[_col_cited_by] = self.get_integers(df[_col_cited_by], self.INTEGER_PATTERN)
 
+        # Get DOIs
+        dois, recovered = self.get_dois(df, schema['doi'])
+        repaired = [value if isinstance(value, str) else None for value in df[self.CSV_REPAIRED]] if self.CSV_REPAIRED in df.columns else [None] * len(df)
+        separators = self.AUTHOR_SEPARATORS_TYPE.get(self.TYPE_FILE, self.AUTHOR_SEPARATORS)
+
+        # Get records
+        records = {}
+        for idx, row in zip(df.index, self.iter_rows(df, [column for column in columns if column in df.columns])):
+            doi = dois[idx]
             year = row[_col_year]
-            if year:
-                year = str(year).strip()
-
-            pattern = re.compile(r'^\d{4}$')
-            if pattern.match(year):
-                year = int(year)
-            else:
-                year = None
 
             collect = {}
             if self.TYPE_FILE == self.TYPE_SCOPUS:
@@ -687,19 +2100,17 @@ class FormatInput:
                 collect[self.xls_col_abstract] = row[self.scopus_col_abstract].strip() if row[self.scopus_col_abstract] else row[self.scopus_col_abstract]
                 collect[self.xls_col_year] = year
                 collect[self.xls_col_doi] = doi
-                collect[self.xls_col_document_type] = row[self.scopus_col_document_type].strip() if row[self.scopus_col_document_type] else row[self.scopus_col_document_type]
-                collect[self.xls_col_language] = row[self.scopus_col_language].strip() if row[self.scopus_col_language] else row[self.scopus_col_language]
+                collect[self.xls_col_document_type] = categories[self.scopus_col_document_type][row[self.scopus_col_document_type]]
+                collect[self.xls_col_language] = categories[self.scopus_col_language][row[self.scopus_col_language]]
                 collect[self.xls_col_cited_by] = row[self.scopus_col_cited_by] if row[self.scopus_col_cited_by] else 0
             elif self.TYPE_FILE in [self.TYPE_WOS, self.TYPE_SCIELO]:
-                document_type = row[self.wos_col_document_type]
-                document_type = self.format_publication_type(document_type)
                 collect[self.xls_col_authors] = row[self.wos_col_authors].strip() if row[self.wos_col_authors] else row[self.wos_col_authors]
                 collect[self.xls_col_title] = row[self.wos_col_title].strip() if row[self.wos_col_title] else row[self.wos_col_title]
                 collect[self.xls_col_abstract] = row[self.wos_col_abstract].strip() if row[self.wos_col_abstract] else row[self.wos_col_abstract]
                 collect[self.xls_col_year] = year
                 collect[self.xls_col_doi] = doi
-                collect[self.xls_col_document_type] = document_type if document_type else document_type
-                collect[self.xls_col_language] = row[self.wos_col_language].strip() if row[self.wos_col_language] else row[self.wos_col_language]
+                collect[self.xls_col_document_type] = categories[self.wos_col_document_type][row[self.wos_col_document_type]]
+                collect[self.xls_col_language] = categories[self.wos_col_language][row[self.wos_col_language]]
                 collect[self.xls_col_cited_by] = row[self.wos_col_cited_by] if row[self.wos_col_cited_by] else row[self.wos_col_cited_by]
             elif self.TYPE_FILE == self.TYPE_PUBMED:
                 collect[self.xls_col_authors] = row[self.pubmed_col_authors].strip() if row[self.pubmed_col_authors] else row[self.pubmed_col_authors]
@@ -716,8 +2127,8 @@ class FormatInput:
                 collect[self.xls_col_abstract] = row[self.pmc_col_abstract].strip() if row[self.pmc_col_abstract] else row[self.pmc_col_abstract]
                 collect[self.xls_col_year] = year
                 collect[self.xls_col_doi] = doi
-                collect[self.xls_col_document_type] = row[self.pmc_col_document_type].strip() if row[self.pmc_col_document_type] else row[self.pmc_col_document_type]
-                collect[self.xls_col_language] = row[self.pmc_col_language].strip() if row[self.pmc_col_language] else row[self.pmc_col_language]
+                collect[self.xls_col_document_type] = categories[self.pmc_col_document_type][row[self.pmc_col_document_type]]
+                collect[self.xls_col_language] = categories[self.pmc_col_language][row[self.pmc_col_language]]
                 collect[self.xls_col_cited_by] = None
             elif self.TYPE_FILE == self.TYPE_DIMENSIONS:
                 collect[self.xls_col_authors] = row[self.dimensions_col_authors].strip() if row[self.dimensions_col_authors] else row[self.dimensions_col_authors]
@@ -752,17 +2163,8 @@ class FormatInput:
                 collect[self.xls_col_abstract] = row[self.embase_col_abstract].strip() if row[self.embase_col_abstract] else row[self.embase_col_abstract]
                 collect[self.xls_col_year] = year
                 collect[self.xls_col_doi] = doi
-                collect[self.xls_col_document_type] = row[self.embase_col_document_type].strip() if row[self.embase_col_document_type] else row[self.embase_col_document_type]
-                collect[self.xls_col_language] = row[self.embase_col_language].strip() if row[self.embase_col_language] else row[self.embase_col_language]
-                collect[self.xls_col_cited_by] = None
-            elif self.TYPE_FILE == self.TYPE_SCIENCEDIRECT:
-                collect[self.xls_col_authors] = row[self.sciencedirect_col_authors].strip() if row[self.sciencedirect_col_authors] else row[self.sciencedirect_col_authors]
-                collect[self.xls_col_title] = row[self.sciencedirect_col_title].strip() if row[self.sciencedirect_col_title] else row[self.sciencedirect_col_title]
-                collect[self.xls_col_abstract] = row[self.sciencedirect_col_abstract].strip() if row[self.sciencedirect_col_abstract] else row[self.sciencedirect_col_abstract]
-                collect[self.xls_col_year] = year
-                collect[self.xls_col_doi] = doi
-                collect[self.xls_col_document_type] = None
-                collect[self.xls_col_language] = None
+                collect[self.xls_col_document_type] = categories[self.embase_col_document_type][row[self.embase_col_document_type]]
+                collect[self.xls_col_language] = categories[self.embase_col_language][row[self.embase_col_language]]
                 collect[self.xls_col_cited_by] = None
             elif self.TYPE_FILE == self.TYPE_IEEE:
                 collect[self.xls_col_authors] = row[self.ieee_col_authors].strip() if row[self.ieee_col_authors] else row[self.ieee_col_authors]
@@ -774,16 +2176,13 @@ class FormatInput:
                 collect[self.xls_col_language] = None
                 collect[self.xls_col_cited_by] = None
             elif self.TYPE_FILE == self.TYPE_BVS:
-                language = row[self.bvs_col_language]
-                language = self.get_language(language)
-                document_type = row[self.bvs_col_document_type].capitalize()
                 collect[self.xls_col_authors] = row[self.bvs_col_authors].strip() if row[self.bvs_col_authors] else row[self.bvs_col_authors]
                 collect[self.xls_col_title] = row[self.bvs_col_title].strip() if row[self.bvs_col_title] else row[self.bvs_col_title]
                 collect[self.xls_col_abstract] = row[self.bvs_col_abstract].strip() if row[self.bvs_col_abstract] else row[self.bvs_col_abstract]
                 collect[self.xls_col_year] = year
                 collect[self.xls_col_doi] = doi
-                collect[self.xls_col_document_type] = document_type if document_type else document_type
-                collect[self.xls_col_language] = language if language else language
+                collect[self.xls_col_document_type] = categories[self.bvs_col_document_type][row[self.bvs_col_document_type]]
+                collect[self.xls_col_language] = categories[self.bvs_col_language][row[self.bvs_col_language]]
                 collect[self.xls_col_cited_by] = None
             elif self.TYPE_FILE == self.TYPE_CAB:
                 collect[self.xls_col_authors] = row[self.cab_col_authors].strip() if row[self.cab_col_authors] else row[self.cab_col_authors]
@@ -792,37 +2191,805 @@ class FormatInput:
                 collect[self.xls_col_year] = year
                 collect[self.xls_col_doi] = doi
                 collect[self.xls_col_document_type] = None
-                collect[self.xls_col_language] = row[self.cab_col_language].strip() if row[self.cab_col_language] else row[self.cab_col_language]
+                collect[self.xls_col_language] = categories[self.cab_col_language][row[self.cab_col_language]]
                 collect[self.xls_col_cited_by] = None
 
-            if flag_unique:
-                collect_unique_doi.update({idx + 1: collect})
-            if flag_duplicate_doi:
-                collect[self.xls_col_duplicate_type] = self.xls_val_by_doi
-                collect_duplicate_doi.update({idx + 1: collect})
-            if flag_without_doi:
-                collect_without_doi.update({idx + 1: collect})
+            for column in self.EXTRA_COLUMNS:
+                collect[column] = row[column].strip() if isinstance(row[column], str) else row[column]
+            if self.REPAIR_ROWS:
+                collect[self.xls_col_repaired] = repaired[idx]
+            if self.PARSE_AUTHORS:
+                collect[self.xls_col_first_author], collect[self.xls_col_author_list] = self.parse_authors(collect[self.xls_col_authors], separators)
+
+            collect[self.xls_col_row] = idx + 1
+            records.update({idx + 1: collect})
+            self.PROGRESS_COUNT += 1
+
+        return records, recovered
+
+    def parse_authors(self, authors, separators):
+        # (first author surname, author list) of an author field. The same
+        # fields repeat a lot, within a source and across sources, the last
+        # AUTHOR_CACHE_SIZE distinct ones are kept parsed
+        if not isinstance(authors, str) or not authors:
+            return None, None
+
+        key = (authors, tuple(separators))
+        parsed = self.AUTHOR_CACHE.get(key)
+        if parsed is None:
+            names = [self.split_author(name) for name in self.split_authors(authors, separators)]
+            parsed = (names[0][0] if names else None,
+                      self.AUTHOR_SEPARATOR.join(["%s, %s" % (surname, given) if given else surname for surname, given in names]) or None)
+            self.AUTHOR_CACHE[key] = parsed
+            if len(self.AUTHOR_CACHE) > self.AUTHOR_CACHE_SIZE:
+                self.AUTHOR_CACHE.popitem(last = False)
+        else:
+            self.AUTHOR_CACHE.move_to_end(key)
+
+        return parsed
+
+    def split_authors(self, authors, separators):
+        # Names of an author field. In a comma list, a part with the shape of
+        # given names (initials or a single word) completes the surname
+        # before it ('van der Berg, J.')
+        separator = next((separator for separator in separators if separator in authors), separators[0])
+        names = []
+        surname_only = False
+        for name in authors.split(separator):
+            name = name.strip()
+            if not name or self.AUTHOR_SKIP.fullmatch(name):
+                continue
+            words = name.split()
+            if surname_only and (len(words) == 1 or all([self.AUTHOR_INITIALS.fullmatch(word) for word in words])):
+                names[-1] = "%s, %s" % (names[-1], name)
+                surname_only = False
+                continue
+            names.append(name)
+            surname_only = separator == ','
+        return names
+
+    def split_author(self, name):
+        # (surname, given names) of 'Surname, Given', 'Surname GI' or 'Given Surname'
+        if ',' in name:
+            surname, _, given = name.partition(',')
+        else:
+            parts = name.split()
+            if len(parts) > 1 and self.AUTHOR_INITIALS.fullmatch(parts[-1]):
+                surname, given = ' '.join(parts[:-1]), parts[-1]
+            elif len(parts) > 1:
+                surname, given = parts[-1], ' '.join(parts[:-1])
+            else:
+                surname, given = name, ''
+        return surname.strip(), given.strip()
+
+    def is_csv_parallel(self, schema):
+        # Big plain files parsed with the python engine semantics (the C engine
+        # of Web of Science reports the bad lines by physical line)
+        file = schema['file']
+        return (self.JOBS > 1 and
+                self.ENGINE == self.ENGINE_AUTO and
+                schema['engine'] == 'python' and
+                self.detect_compression(file) is None and
+                os.path.getsize(file) >= self.CSV_PARALLEL_SIZE)
+
+    def read_csv_parallel(self, schema):
+        # The file is split in byte ranges of about CSV_CHUNK_SIZE at record
+        # boundaries (the csv scan knows the quoted newlines), each range is
+        # parsed, normalized and keyed in a separate process and the results
+        # are joined in file order, so the rows and the first-seen order are
+        # the same as in a single process
+        file = schema['file']
+        separator = schema['separator']
+        projection = self.get_csv_projection(file, separator, None, schema['columns'], schema['dtypes'])
+        self.check_columns([column.strip() for column in projection['usecols']], file, schema['required'])
+
+        header_end, header_records, chunks = self.get_csv_chunks(file, separator, self.CSV_CHUNK_SIZE)
+
+        self.show_print("  Parallel parsing: %s chunks in %s processes" % (len(chunks), min(self.JOBS, len(chunks))), [self.LOG_FILE])
+        self.progress_start(self.STAGE_NORMALIZING, 'records')
+
+        kwargs = dict(projection, header = 0, index_col = False)
+        with concurrent.futures.ProcessPoolExecutor(max_workers = min(self.JOBS, len(chunks))) as executor:
+            futures = [executor.submit(self.read_csv_chunk, schema, header_end, header_records, chunk, kwargs) for chunk in chunks]
+            for future in concurrent.futures.as_completed(futures):
+                self.PROGRESS_COUNT += len(future.result()[0])
+
+            records = {}
+            title_keys = {}
+            bad_line_numbers = []
+            recovered = 0
+            for future in futures:
+                _records, _title_keys, _bad_line_numbers, _recovered = future.result()
+                offset = len(records)
+                for row, collect in _records.items():
+                    collect[self.xls_col_row] = row + offset
+                    records.update({row + offset: collect})
+                    title_keys.update({row + offset: _title_keys[row]})
+                bad_line_numbers.extend(_bad_line_numbers)
+                recovered += _recovered
+
+        self.TITLE_KEYS = title_keys
+        self.measure_keys(self.STRUCTURE_TITLE_KEYS, title_keys, len(title_keys))
+        bad_lines = self.get_bad_lines(file, None, bad_line_numbers)
+
+        return records, bad_lines, recovered
+
+    def get_csv_chunks(self, file, separator, chunk_size):
+        # Segments of the file grouped in chunks of about chunk_size bytes, the
+        # clean segments are cut at the record boundaries of the scan
+        header_end, header_records, end_of_file, regions, boundaries = self.find_csv_problem_regions(file, separator, chunk_size = chunk_size)
+        pieces = []
+        for start_byte, end_byte, start_record, engine in self.get_csv_segments(header_end, header_records, end_of_file, regions):
+            if engine == 'c':
+                for byte, record in boundaries:
+                    if start_byte < byte < end_byte:
+                        pieces.append((start_byte, byte, start_record, engine))
+                        start_byte, start_record = byte, record
+            pieces.append((start_byte, end_byte, start_record, engine))
+
+        chunks = self.group_csv_segments(pieces, chunk_size)
+
+        return header_end, header_records, chunks
+
+    def group_csv_segments(self, segments, chunk_size):
+        # Consecutive segments in groups of about chunk_size bytes
+        chunks = [[]]
+        size = 0
+        for segment in segments:
+            chunks[-1].append(segment)
+            size += segment[1] - segment[0]
+            if size >= chunk_size:
+                chunks.append([])
+                size = 0
+        return [chunk for chunk in chunks if chunk]
+
+    def read_csv_chunk(self, schema, header_end, header_records, segments, kwargs):
+        # Records of some segments of a file (rows from 1), with their title
+        # keys, the bad line numbers and the DOIs found in the fallback columns
+        with open(schema['file'], 'rb') as fb:
+            header_bytes = fb.read(header_end)
+            records, bad_line_numbers, recovered = self.parse_csv_chunk(fb, header_bytes, header_records, segments, schema, kwargs)
+        title_keys = self.get_title_keys(records)
+
+        return records, title_keys, bad_line_numbers, recovered
+
+    def parse_csv_chunk(self, fb, header_bytes, header_records, segments, schema, kwargs):
+        frames = []
+        bad_line_numbers = []
+        if self.REPAIR_ROWS:
+            _df, bad_line_numbers = self.read_csv_repaired(fb, header_bytes, segments, sep = schema['separator'], shapes = schema['shapes'], **kwargs)
+            frames.append(_df)
+        else:
+            for segment in segments:
+                _df, _bad = self.read_csv_segment(fb, header_bytes, header_records, segment, sep = schema['separator'], **kwargs)
+                frames.append(_df)
+                bad_line_numbers.extend(_bad)
+
+        df = pd.concat(frames, ignore_index = True)
+        df.columns = df.columns.str.strip()
+        records, recovered = self.normalize_frame(df, schema)
+
+        return records, bad_line_numbers, recovered
+
+    def is_ris_file(self, file):
+        # The type of the first record is in one of the first lines
+        with self.open_input(file, encoding = 'utf-8-sig', errors = 'replace') as fr:
+            for line in itertools.islice(fr, self.RIS_DETECT_LINES):
+                match = self.RIS_LINE.match(line.rstrip('\r\n'))
+                if match and match.group(1) == self.RIS_TAG_TYPE:
+                    return True
+        return False
+
+    def iter_ris_records(self, file, bad_lines, tags = None):
+        # Records of a RIS file ({tag: [values]}), one at a time. Lines without
+        # a tag continue the last value, outside of a record they are bad lines.
+        # Only the given tags are kept, if any
+        record = None
+        last_tag = None
+        with self.open_input(file, encoding = 'utf-8-sig', errors = 'replace') as fr:
+            for line_number, line in enumerate(fr, start = 1):
+                line = line.rstrip('\r\n')
+                match = self.RIS_LINE.match(line)
+                if match:
+                    tag = match.group(1)
+                    value = (match.group(2) or '').strip()
+                    if tag == self.RIS_TAG_TYPE:
+                        if record is not None: # Without end tag
+                            yield record
+                        record = {tag: [value]}
+                        last_tag = tag
+                    elif record is None:
+                        bad_lines.append({'line_number': line_number, 'raw': line})
+                    elif tag == self.RIS_TAG_END:
+                        yield record
+                        record = None
+                        last_tag = None
+                    elif tags is None or tag in tags:
+                        record.setdefault(tag, []).append(value)
+                        last_tag = tag
+                    else:
+                        last_tag = None
+                elif line.strip():
+                    if record is not None:
+                        if last_tag is not None:
+                            values = record[last_tag]
+                            values[-1] = ("%s %s" % (values[-1], line.strip())).strip()
+                    else:
+                        bad_lines.append({'line_number': line_number, 'raw': line})
+
+            if record is not None:
+                yield record
+
+    def get_ris_fields(self):
+        fields = dict(self.RIS_FIELDS)
+        fields.update(self.RIS_FIELDS_TYPE.get(self.TYPE_FILE, {}))
+        for column in self.EXTRA_COLUMNS:
+            if not self.RIS_TAG.match(column):
+                self.show_print("  Column '%s' isn't a RIS tag, please check the option --extra-columns" % column, [self.LOG_FILE], font = self.YELLOW)
+                exit()
+            fields.update({column: [column]})
+        return fields
+
+    def get_ris_value(self, record, tags):
+        # Value of the first tag (in order) that has one, the values of the
+        # repeated tags are joined
+        for tag in tags:
+            values = [value for value in record.get(tag, []) if value]
+            if values:
+                if tag in self.RIS_MULTIPLE:
+                    return self.RIS_SEPARATOR.join(values)
+                return values[0]
+        return ''
+
+    def get_ris_cited_by(self, value):
+        if value.isdigit():
+            return int(value)
+        match = self.RIS_CITED_BY.search(value)
+        return int(match.group(1)) if match else None
+
+    def read_ris_file(self, file):
+        records = {}
+        bad_lines = []
+        for batch in self.iter_ris_batches(file, bad_lines):
+            records.update(batch)
+
+        self.progress_stop()
+        return records, bad_lines
+
+    def iter_ris_batches(self, file, bad_lines):
+        # The records are normalized in chunks while the file is read, the
+        # raw records are never held all at once
+        self.show_print("  Format: RIS", [self.LOG_FILE])
+        fields = self.get_ris_fields()
+
+        tags = set(itertools.chain.from_iterable(tags for tags in fields.values() if tags))
+        start = 1
+        recovered = 0
+        ris_records = self.iter_ris_records(file, bad_lines, tags)
+        while True:
+            chunk = list(itertools.islice(ris_records, self.DEDUP_CHUNK))
+            if not chunk:
+                break
+            records, _recovered = self.normalize_ris_records(chunk, fields, start)
+            start += len(records)
+            recovered += _recovered
+            yield records
+
+        if recovered:
+            self.show_print("  DOIs found in other columns: %s" % recovered, [self.LOG_FILE])
+
+    def normalize_ris_records(self, chunk, fields, start):
+        # Records of a chunk of RIS records, rows from start
+        records = {}
+        values = {field: [self.get_ris_value(record, tags) for record in chunk] for field, tags in fields.items() if tags}
+
+        # Get DOIs
+        doi_columns = [column for column in [self.xls_col_doi, self.RIS_DOI_FALLBACK] if column in values]
+        df = pd.DataFrame({column: values[column] for column in doi_columns}, index = range(len(chunk)))
+        dois, recovered = self.get_dois(df, doi_columns)
+
+        for idx in range(len(chunk)):
+            collect = {}
+            for field in [self.xls_col_authors,
+                          self.xls_col_title,
+                          self.xls_col_abstract,
+                          self.xls_col_year,
+                          self.xls_col_doi,
+                          self.xls_col_document_type,
+                          self.xls_col_language,
+                          self.xls_col_cited_by] + self.EXTRA_COLUMNS:
+                collect[field] = values[field][idx] if field in values else None
+
+            # ScienceDirect titles are shown without their curly quotes
+            if self.TYPE_FILE == self.TYPE_SCIENCEDIRECT:
+                if collect[self.xls_col_title]:
+                    collect[self.xls_col_title] = collect[self.xls_col_title].replace('“', '').replace('”', '')
+                if collect[self.xls_col_abstract]:
+                    collect[self.xls_col_abstract] = collect[self.xls_col_abstract].replace('"', '')
+
+            year = self.RIS_YEAR.match(collect[self.xls_col_year] or '')
+            collect[self.xls_col_year] = int(year.group(1)) if year else None
+            collect[self.xls_col_doi] = dois[idx]
+
+            document_type = collect[self.xls_col_document_type]
+            if document_type:
+                collect[self.xls_col_document_type] = sys.intern(self.RIS_TYPES.get(document_type, document_type))
+            if collect[self.xls_col_language]:
+                collect[self.xls_col_language] = sys.intern(collect[self.xls_col_language])
+
+            if collect[self.xls_col_cited_by]:
+                collect[self.xls_col_cited_by] = self.get_ris_cited_by(collect[self.xls_col_cited_by])
+
+            if self.PARSE_AUTHORS:
+                collect[self.xls_col_first_author], collect[self.xls_col_author_list] = self.parse_authors(collect[self.xls_col_authors], [self.RIS_SEPARATOR.strip()])
+
+            collect[self.xls_col_row] = start + idx
+            records.update({start + idx: collect})
+            self.PROGRESS_COUNT += 1
+
+        return records, recovered
+
+    def get_integers(self, values, pattern):
+        # Nullable integers of the values that match the pattern, <NA> otherwise
+        values = values.astype(self.DTYPE_TEXT).str.strip()
+        values = values.where(values.str.fullmatch(pattern).fillna(False))
+        return pd.to_numeric(values).astype(self.DTYPE_INTEGER)
+
+    def iter_rows(self, df, columns):
+        # Rows of a typed frame as dicts of plain values: missing text is ''
+        # and missing numbers are None. Converted column by column, the frame
+        # is never copied as a whole
+        values = []
+        for column in columns:
+            series = df[column]
+            default = None if pd.api.types.is_numeric_dtype(series.dtype) else ''
+            values.append(series.astype(object).where(series.notna(), default).tolist())
+
+        for row in zip(*values):
+            yield dict(zip(columns, row))
+
+    def get_category_values(self, series, transform):
+        # {value: transformed value} for the categories of a column and for
+        # missing text (''), so a transform runs once per distinct value and
+        # the records share one interned string per value
+        values = {}
+        for value in list(series.cat.categories) + ['']:
+            result = transform(value)
+            values[value] = sys.intern(result) if type(result) is str else result
+
+        return values
+
+    def classify_records(self, records, bad_lines):
+        self.measure_records(records)
+        if self.CORPUS_FILE:
+            n_seen, n_hits = self.check_corpus(records)
+            self.show_print("  Previously seen records: %s (filter hits: %s)" % (n_seen, n_hits), [self.LOG_FILE])
+
+        self.progress_start(self.STAGE_DEDUPLICATING, 'keys')
+        if self.DEDUP == self.DEDUP_CLUSTER:
+            collect_papers = self.classify_clusters(records)
+        else:
+            collect_papers = self.classify_sequential(records)
+        collect_papers.update({'bad': bad_lines})
+        self.progress_stop()
+
+        return collect_papers
+
+    def get_dois(self, df, columns):
+        # Canonical DOIs (lowercase, without prefixes, links or trailing
+        # punctuation) of the whole columns at once, each record takes the
+        # DOI of its first column (in order) that has one. Also returns the
+        # number of DOIs found in the other columns
+        dois = pd.Series('', index = df.index, dtype = object)
+        recovered = 0
+        for icol, column in enumerate(columns):
+            missing = dois == ''
+            if column not in df.columns or not missing.any():
+                continue
+
+            found = self.extract_dois(df.loc[missing, column]).dropna()
+            dois[found.index] = found
+            if icol > 0:
+                recovered += len(found)
+
+        return dois, recovered
+
+    def extract_dois(self, values):
+        # Canonical DOI of each value, NaN if it has none
+        values = values.astype(str)
+        values = values.str.replace(self.DOI_ENCODED_SLASH, '/', regex = True)
+        query = values.str.contains('?', regex = False) | values.str.contains('#', regex = False)
+        if query.any():
+            values[query] = values[query].str.replace(self.DOI_URL_QUERY, r'\1', regex = True)
+        dois = values.str.extract(self.DOI_PATTERN, expand = False)
+        closing = dois.str.endswith(')').fillna(False).astype(bool)
+        if closing.any():
+            dois[closing] = dois[closing].map(self.strip_doi_parentheses)
+        dois = dois.str.lower().str.replace(self.DOI_URL_SUFFIX, '', regex = True)
+        return dois
+
+    def strip_doi_parentheses(self, doi):
+        # The DOI without the closing parentheses of the surrounding text
+        while doi.endswith(')') and doi.count(')') > doi.count('('):
+            doi = doi[:-1].rstrip(self.DOI_PUNCTUATION)
+        return doi
+
+    def records_to_table(self, records):
+        # Object columns keep the values exactly as they are (e.g. years as int or None)
+        rows = list(records.keys())
+        columns = list(records[rows[0]].keys()) if rows else []
+        table = pd.DataFrame({column: pd.Series([records[row].get(column) for row in rows], index = rows, dtype = object) for column in columns})
+        return table
+
+    def table_to_records(self, table):
+        return table.to_dict('index')
+
+    def get_file_hash(self, file):
+        file_hash = hashlib.blake2b(digest_size = 20)
+        with open(file, 'rb') as fb:
+            for chunk in iter(lambda: fb.read(1024 * 1024), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def get_cache_file(self):
+        # The key covers the input content, the source type and the tool version
+        # (including the script itself, so that changes of the normalization
+        # never reuse stale tables)
+        key = hashlib.blake2b(digest_size = 20)
+        key.update(self.get_file_hash(self.INPUT_FILE).encode())
+        key.update(self.get_file_hash(os.path.realpath(__file__)).encode())
+        for option in [self.TYPE_FILE, self.VERSION] + self.get_cache_options():
+            key.update(("%s\0" % option).encode())
+
+        return os.path.join(self.CACHE_DIR, "%s_%s%s" % (self.TYPE_FILE, key.hexdigest(), self.CACHE_EXTENSION))
+
+    def get_cache_options(self):
+        # Options that change the normalized records
+        return [','.join(self.EXTRA_COLUMNS), str(self.REPAIR_ROWS), str(self.PARSE_AUTHORS)]
+
+    def load_cache(self, cache_file):
+        cached = None
+        if os.path.exists(cache_file):
+            try:
+                table = pd.read_pickle(cache_file)
+                records = self.table_to_records(table[self.CACHE_RECORDS])
+                bad_lines = table[self.CACHE_BAD_LINES]
+                cached = (records, bad_lines)
+                os.utime(cache_file) # Most recently used
+                self.show_print("  Using the cached records: %s" % cache_file, [self.LOG_FILE])
+            except Exception as e:
+                self.show_print("  Couldn't read the cache file '%s' (%s), parsing the input file" % (cache_file, e), [self.LOG_FILE], font = self.YELLOW)
+        return cached
+
+    def save_cache(self, cache_file, records, bad_lines):
+        table = {self.CACHE_RECORDS: self.records_to_table(records),
+                 self.CACHE_BAD_LINES: bad_lines}
+        fw_tmp = None
+        try:
+            created = self.create_directory(self.CACHE_DIR)
+            if not created:
+                raise OSError("couldn't create folder '%s'" % self.CACHE_DIR)
+
+            # Atomic, concurrent runs never read a partial file
+            fw_tmp = tempfile.NamedTemporaryFile(dir = self.CACHE_DIR, prefix = '.tmp_', suffix = self.CACHE_EXTENSION, delete = False)
+            fw_tmp.close()
+            pd.to_pickle(table, fw_tmp.name)
+            os.replace(fw_tmp.name, cache_file)
+        except Exception as e:
+            # A partial file is never counted by the eviction, it's removed here
+            if fw_tmp is not None and os.path.exists(fw_tmp.name):
+                os.remove(fw_tmp.name)
+            self.show_print("  Couldn't write the cache file '%s' (%s)" % (cache_file, e), [self.LOG_FILE], font = self.YELLOW)
+            return
+
+        self.evict_cache()
+
+    def evict_cache(self):
+        # Least recently used entries are removed until the cache fits its size
+        entries = []
+        for name in os.listdir(self.CACHE_DIR):
+            path = os.path.join(self.CACHE_DIR, name)
+            if name.endswith(self.CACHE_EXTENSION) and not name.startswith('.tmp_') and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum([size for _, size, _ in entries])
+        for _, size, path in sorted(entries):
+            if total <= self.CACHE_SIZE * 1024 * 1024:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def get_title_table(self):
+        # Translation table of the title keys, built once per run: punctuation
+        # is replaced by spaces, apostrophes and format characters (soft
+        # hyphens, zero-width spaces) are removed and, in the ASCII mode, also
+        # the combining marks of the decomposed letters. A list indexed by code
+        # point is faster than a dict for str.translate, code points out of
+        # the BMP are left as they are
+        if self.TITLE_KEY not in self.TITLE_TABLES:
+            table = []
+            for code in range(0x10000):
+                char = chr(code)
+                category = unicodedata.category(char)
+                if category[0] == 'P':
+                    char = ' '
+                elif category == 'Cf':
+                    char = ''
+                elif category == 'Mn' and self.TITLE_KEY == self.TITLE_KEY_ASCII:
+                    char = ''
+                table.append(char)
+            for char in self.TITLE_APOSTROPHES:
+                table[ord(char)] = ''
+            if self.TITLE_KEY == self.TITLE_KEY_ASCII:
+                for char, value in self.TITLE_LIGATURES.items():
+                    table[ord(char)] = value
+            self.TITLE_TABLES.update({self.TITLE_KEY: table})
+        return self.TITLE_TABLES[self.TITLE_KEY]
+
+    def get_corpus_files(self):
+        # The filter and the index live next to the key list, one pair per
+        # title key mode (the keys of the titles depend on it)
+        prefix = "%s.%s" % (self.CORPUS_FILE, self.TITLE_KEY)
+        return prefix + self.CORPUS_BLOOM_EXTENSION, prefix + self.CORPUS_INDEX_EXTENSION
+
+    def get_corpus_keys(self, values):
+        # Values with a DOI are DOI keys, the others are title keys
+        values = pd.Series(values, dtype = object)
+        dois = self.extract_dois(values)
+        keys = self.CORPUS_KEY_TITLE + self.normalize_titles(values)
+        keys = keys.where(dois.isna(), self.CORPUS_KEY_DOI + dois)
+        keys = keys[keys.str.len() > len(self.CORPUS_KEY_TITLE)] # Without empty titles
+        return keys
+
+    def get_bloom_positions(self, keys, n_bits, n_hashes):
+        # Double hashing, two 64-bit halves of one blake2b digest per key
+        digests = b''.join([hashlib.blake2b(key.encode(), digest_size = 16).digest() for key in keys])
+        hashes = np.frombuffer(digests, dtype = np.uint64).reshape(-1, 2)
+        steps = np.arange(n_hashes, dtype = np.uint64)
+        positions = (hashes[:, :1] + steps * hashes[:, 1:]) % np.uint64(n_bits)
+        return positions
+
+    def build_corpus(self, bloom_file, index_file):
+        self.show_print("  Building the corpus filter and index: %s" % self.CORPUS_FILE, [self.LOG_FILE])
+        with self.open_input(self.CORPUS_FILE, errors = 'replace') as fr:
+            n_keys = sum(1 for line in fr if line.strip())
+
+        # Optimal size for the false positive rate (about 1.2 bytes per key at 1%)
+        n_bits = max(64, int(-max(1, n_keys) * np.log(self.CORPUS_FALSE_POSITIVE) / np.log(2) ** 2))
+        n_hashes = max(1, int(round(n_bits / max(1, n_keys) * np.log(2))))
+
+        directory = os.path.dirname(os.path.abspath(bloom_file))
+        bloom_tmp = tempfile.NamedTemporaryFile(dir = directory, prefix = '.tmp_', suffix = self.CORPUS_BLOOM_EXTENSION, delete = False)
+        index_tmp = tempfile.NamedTemporaryFile(dir = directory, prefix = '.tmp_', suffix = self.CORPUS_INDEX_EXTENSION, delete = False)
+        bloom_tmp.close()
+        index_tmp.close()
+        try:
+            header = self.CORPUS_MAGIC + np.array([n_bits, n_hashes, n_keys], dtype = np.uint64).tobytes()
+            with open(bloom_tmp.name, 'wb') as fw:
+                fw.write(header)
+                fw.truncate(len(header) + (n_bits + 7) // 8)
+            bits = np.memmap(bloom_tmp.name, dtype = np.uint8, mode = 'r+', offset = len(header))
+
+            connection = sqlite3.connect(index_tmp.name)
+            connection.execute("CREATE TABLE keys (key TEXT PRIMARY KEY) WITHOUT ROWID")
+            with self.open_input(self.CORPUS_FILE, errors = 'replace') as fr:
+                lines = (line.strip() for line in fr)
+                lines = (line for line in lines if line)
+                while True:
+                    chunk = list(itertools.islice(lines, self.CORPUS_CHUNK))
+                    if not chunk:
+                        break
+                    keys = self.get_corpus_keys(chunk).tolist()
+                    positions = self.get_bloom_positions(keys, n_bits, n_hashes).ravel()
+                    np.bitwise_or.at(bits, positions >> np.uint64(3), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+                    connection.executemany("INSERT OR IGNORE INTO keys VALUES (?)", [(key,) for key in keys])
+                    connection.commit()
+            connection.close()
+            bits.flush()
+            del bits
+
+            os.replace(bloom_tmp.name, bloom_file)
+            os.replace(index_tmp.name, index_file)
+        except Exception:
+            for name in [bloom_tmp.name, index_tmp.name]:
+                if os.path.exists(name):
+                    os.remove(name)
+            raise
+
+    def check_corpus(self, records):
+        # Records already in the corpus: the memory-mapped Bloom filter discards
+        # most of them cheaply, its hits are confirmed by the exact index
+        bloom_file, index_file = self.get_corpus_files()
+        corpus_mtime = os.path.getmtime(self.CORPUS_FILE)
+        if not all([os.path.exists(file) and os.path.getmtime(file) >= corpus_mtime for file in [bloom_file, index_file]]):
+            self.build_corpus(bloom_file, index_file)
+
+        header_size = len(self.CORPUS_MAGIC) + 3 * 8
+        with open(bloom_file, 'rb') as fr:
+            header = fr.read(header_size)
+        if not header.startswith(self.CORPUS_MAGIC):
+            raise ValueError("'%s' isn't a corpus filter" % bloom_file)
+        n_bits, n_hashes, _ = np.frombuffer(header[len(self.CORPUS_MAGIC):], dtype = np.uint64).tolist()
+        bits = np.memmap(bloom_file, dtype = np.uint8, mode = 'r', offset = header_size)
+
+        rows = list(records.keys())
+        title_keys = self.get_title_keys(records)
+        candidates = []
+        for row in rows:
+            if records[row][self.xls_col_doi]:
+                candidates.append((row, self.CORPUS_KEY_DOI + records[row][self.xls_col_doi], self.xls_val_by_doi))
+            if title_keys[row]:
+                candidates.append((row, self.CORPUS_KEY_TITLE + title_keys[row], self.xls_val_by_title))
+
+        hits = []
+        if candidates:
+            positions = self.get_bloom_positions([key for _, key, _ in candidates], n_bits, n_hashes)
+            found = ((bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1).all(axis = 1)
+            hits = [candidate for candidate, flag in zip(candidates, found) if flag]
+        del bits
+
+        seen = {}
+        if hits:
+            connection = sqlite3.connect("file:%s?mode=ro" % index_file, uri = True)
+            for start in range(0, len(hits), self.CORPUS_QUERY_SIZE):
+                batch = hits[start:start + self.CORPUS_QUERY_SIZE]
+                query = "SELECT key FROM keys WHERE key IN (%s)" % ','.join(['?'] * len(batch))
+                confirmed = set([key for key, in connection.execute(query, [key for _, key, _ in batch])])
+                for row, key, match in batch:
+                    if key in confirmed and row not in seen:
+                        seen.update({row: match})
+            connection.close()
+
+        for row in rows:
+            records[row][self.xls_col_previously_seen] = seen.get(row)
+
+        return len(seen), len(hits)
+
+    def get_title_keys(self, records):
+        # Match keys of the titles, the whole column is normalized at once
+        # records: {row: record}, returns {row: key}
+        if self.TITLE_KEYS is not None:
+            return {row: self.TITLE_KEYS[row] for row in records}
+
+        titles = pd.Series([record[self.xls_col_title] for record in records.values()], index = list(records.keys()), dtype = object)
+        return self.normalize_titles(titles).to_dict()
+
+    def normalize_titles(self, titles):
+        titles = titles.fillna('').astype(str)
+        if self.TITLE_KEY == self.TITLE_KEY_SIMPLE:
+            keys = titles.str.strip().str.lower()
+            keys = keys.where(~keys.str.endswith('.'), keys.str[:-1])
+        else:
+            entities = titles.str.contains('&', regex = False)
+            if entities.any():
+                titles[entities] = titles[entities].map(html.unescape)
+            keys = titles.str.normalize('NFKC').str.casefold()
+            if self.TITLE_KEY == self.TITLE_KEY_ASCII:
+                keys = keys.str.normalize('NFD')
+            keys = keys.str.translate(self.get_title_table())
+            keys = keys.str.split().str.join(' ')
+        return keys
+
+    def iter_title_keys(self, records, rows):
+        # (key, row) of the titles, normalized by chunks of the column
+        if self.TITLE_KEYS is not None:
+            yield from ((self.TITLE_KEYS[row], row) for row in rows)
+            return
+
+        for start in range(0, len(rows), self.DEDUP_CHUNK):
+            chunk = rows[start:start + self.DEDUP_CHUNK]
+            titles = pd.Series([records[row][self.xls_col_title] for row in chunk], dtype = object)
+            yield from zip(self.normalize_titles(titles).tolist(), chunk)
+
+    def find_first_seen(self, pairs, n_keys, structure = None):
+        # Duplicates of the (key, position) pairs, in order of position:
+        # {position: first position of its key}. The index of the keys is kept
+        # in memory while it and the duplicates fit the budget (--max-memory),
+        # then all the keys are partitioned by hash into files that are
+        # resolved one by one
+        duplicates = {}
+        index = {}
+        size = 0
+        budget = self.MAX_MEMORY * 1024 * 1024 if self.MAX_MEMORY else None
+        pairs = iter(pairs)
+        for count, (key, position) in enumerate(pairs, start = 1):
+            self.PROGRESS_COUNT += 1
+            if not key:
+                continue
+            if key in index:
+                duplicates.update({position: index[key]})
+                if budget:
+                    size += self.DEDUP_DUPLICATE_SIZE
+            else:
+                index.update({key: position})
+                if budget:
+                    size += sys.getsizeof(key) + self.DEDUP_ENTRY_SIZE
+            if budget and size > budget:
+                # Partitions of about half the budget each
+                total = size * n_keys / count
+                n_partitions = min(self.DEDUP_MAX_PARTITIONS, max(2, int(np.ceil(2 * total / budget))))
+                self.show_print("  Dedup index over the memory budget (%s MB), spilling to %s partitions" % (self.MAX_MEMORY, n_partitions), [self.LOG_FILE])
+                remaining = itertools.chain(index.items(), pairs)
+                index = None
+                duplicates.update(self.find_first_seen_partitioned(remaining, n_partitions))
+                break
+
+        if structure and index is not None:
+            self.measure_keys(structure, index, n_keys)
+
+        return duplicates
+
+    def find_first_seen_partitioned(self, pairs, n_partitions):
+        # Every key falls in one partition, where its pairs keep their order,
+        # so the first pair of a key in its partition is the first seen
+        duplicates = {}
+        with tempfile.TemporaryDirectory(prefix = 'format_input_dedup_') as directory:
+            files = [os.path.join(directory, "partition_%s.pkl" % i) for i in range(n_partitions)]
+            handles = [open(file, 'wb') for file in files]
+            buffers = [[] for _ in range(n_partitions)]
+            for key, position in pairs:
+                self.PROGRESS_COUNT += 1
+                if not key:
+                    continue
+                partition = hash(key) % n_partitions
+                buffers[partition].append((key, position))
+                if len(buffers[partition]) >= self.DEDUP_BUFFER_SIZE:
+                    pickle.dump(buffers[partition], handles[partition], protocol = pickle.HIGHEST_PROTOCOL)
+                    buffers[partition] = []
+            for partition, fw in enumerate(handles):
+                if buffers[partition]:
+                    pickle.dump(buffers[partition], fw, protocol = pickle.HIGHEST_PROTOCOL)
+                fw.close()
+            buffers = None
+
+            for file in files:
+                index = {}
+                with open(file, 'rb') as fr:
+                    while True:
+                        try:
+                            chunk = pickle.load(fr)
+                        except EOFError:
+                            break
+                        for key, position in chunk:
+                            if key in index:
+                                duplicates.update({position: index[key]})
+                            else:
+                                index.update({key: position})
+                os.remove(file)
+
+        return duplicates
+
+    def classify_sequential(self, records):
+        # Records with DOI are deduplicated by DOI, then the unique ones by title
+        rows_doi = [idx for idx, row in records.items() if row[self.xls_col_doi]]
+        canonical = self.find_first_seen(((records[idx][self.xls_col_doi], idx) for idx in rows_doi), len(rows_doi), self.STRUCTURE_DOI_INDEX)
+
+        collect_unique_doi = {}
+        collect_duplicate_doi = {}
+        collect_without_doi = {}
+        for idx, row in records.items():
+            if not row[self.xls_col_doi]:
+                collect_without_doi.update({idx: row})
+            elif idx in canonical:
+                row[self.xls_col_duplicate_type] = self.xls_val_by_doi
+                collect_duplicate_doi.update({idx: row})
+            else:
+                collect_unique_doi.update({idx: row})
 
         # Get titles
+        rows_unique_doi = list(collect_unique_doi.keys())
+        canonical_title = self.find_first_seen(self.iter_title_keys(records, rows_unique_doi), len(rows_unique_doi), self.STRUCTURE_TITLE_INDEX)
+        canonical.update(canonical_title)
+
         collect_unique = {}
         collect_duplicate_title = {}
-        nr_title = []
         index = 1
         for idx, row in collect_unique_doi.items():
-            flag_unique = False
-
-            title = row[self.xls_col_title]
-            if title:
-                title = title.strip()
-                title = title.lower()
-                title = title[:-1] if title.endswith('.') else title
-                if title not in nr_title:
-                    nr_title.append(title)
-                    flag_unique = True
-            else:
-                flag_unique = True
-
-            if flag_unique:
+            if idx not in canonical_title:
                 collect_unique.update({index: row})
                 index += 1
             else:
@@ -834,94 +3001,477 @@ class FormatInput:
         collect_duplicate.update(collect_duplicate_title)
         collect_duplicate = {item[0]: item[1] for item in sorted(collect_duplicate.items())}
 
+        if self.MERGE_DUPLICATES and canonical:
+            self.merge_duplicates(records, canonical)
+
         collect_papers = {self.XLS_SHEET_UNIQUE: collect_unique,
                           self.XLS_SHEET_WITHOUT_DOI: collect_without_doi,
-                          self.XLS_SHEET_DUPLICATES: collect_duplicate,
-                          'bad': bad_lines}
+                          self.XLS_SHEET_DUPLICATES: collect_duplicate}
 
         return collect_papers
 
-    def save_summary_xls(self, data_paper):
+    def classify_stream(self, batches):
+        # Same classification as classify_sequential, batch by batch: a record
+        # is a duplicate if its DOI was seen before, the records with a new DOI
+        # are then deduplicated by title. Yields the (sheet type, index, record)
+        # of each batch, only the keys seen so far are kept
+        seen_dois = set()
+        seen_titles = set()
+        index = 1
+        n_seen = 0
+        n_hits = 0
+        n_records = 0
+        for records in batches:
+            self.measure_records(records)
+            n_records += len(records)
+            if self.CORPUS_FILE:
+                _n_seen, _n_hits = self.check_corpus(records)
+                n_seen += _n_seen
+                n_hits += _n_hits
+
+            rows_unique_doi = []
+            for row, record in records.items():
+                doi = record[self.xls_col_doi]
+                if doi and doi not in seen_dois:
+                    seen_dois.add(doi)
+                    rows_unique_doi.append(row)
+            title_keys = {row: key for key, row in self.iter_title_keys(records, rows_unique_doi)}
+
+            items = []
+            for row, record in records.items():
+                if not record[self.xls_col_doi]:
+                    items.append((self.XLS_SHEET_WITHOUT_DOI, row, record))
+                elif row not in title_keys:
+                    record[self.xls_col_duplicate_type] = self.xls_val_by_doi
+                    items.append((self.XLS_SHEET_DUPLICATES, row, record))
+                elif title_keys[row] in seen_titles:
+                    record[self.xls_col_duplicate_type] = self.xls_val_by_title
+                    items.append((self.XLS_SHEET_DUPLICATES, row, record))
+                else:
+                    if title_keys[row]:
+                        seen_titles.add(title_keys[row])
+                    items.append((self.XLS_SHEET_UNIQUE, index, record))
+                    index += 1
+            yield items
+
+        self.measure_keys(self.STRUCTURE_DOI_INDEX, seen_dois, n_records)
+        self.measure_keys(self.STRUCTURE_TITLE_INDEX, seen_titles, n_records)
+        if self.CORPUS_FILE:
+            self.show_print("  Previously seen records: %s (filter hits: %s)" % (n_seen, n_hits), [self.LOG_FILE])
+
+    def classify_clusters(self, records):
+        # Union-find over every match key (DOI and title), transitive duplicates
+        # end up in the same cluster. The canonical record of a cluster is its
+        # first record with DOI, or its first record if none has DOI.
+        rows = list(records.keys())
+        parent = list(range(len(rows)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        def union(i, j):
+            root_i = find(i)
+            root_j = find(j)
+            if root_i != root_j:
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+
+        duplicates_doi = self.find_first_seen(((records[row][self.xls_col_doi], i) for i, row in enumerate(rows)), len(rows))
+        for i, first in duplicates_doi.items():
+            union(first, i)
+        shared_doi = set(duplicates_doi.keys()) | set(duplicates_doi.values())
+        duplicates_doi = None
+
+        title_keys = ((key, i) for i, (key, _) in enumerate(self.iter_title_keys(records, rows)))
+        for i, first in self.find_first_seen(title_keys, len(rows)).items():
+            union(first, i)
+
+        clusters = {}
+        for i in range(len(rows)):
+            clusters.setdefault(find(i), []).append(i)
 
-        def create_sheet(oworkbook, sheet_type, dictionary, styles_title, styles_rows):
-            if self.TYPE_FILE == self.TYPE_TXT:
-                _xls_columns = self.xls_columns_txt.copy()
+        collect_unique = {}
+        collect_without_doi = {}
+        collect_duplicate = {}
+        canonical = {}
+        index = 1
+        for cluster, (_, members) in enumerate(sorted(clusters.items()), start = 1):
+            first = next((i for i in members if records[rows[i]][self.xls_col_doi]), members[0])
+            record = records[rows[first]]
+            record[self.xls_col_cluster] = cluster
+            if record[self.xls_col_doi]:
+                collect_unique.update({index: record})
+                index += 1
             else:
-                _xls_columns = self.xls_columns_csv.copy()
+                collect_without_doi.update({rows[first]: record})
 
-            if sheet_type == self.XLS_SHEET_DUPLICATES:
-                _xls_columns.append(self.xls_col_duplicate_type)
+            for i in members:
+                if i != first:
+                    duplicate_type = self.xls_val_by_doi if i in shared_doi else self.xls_val_by_title
+                    canonical.update({rows[i]: rows[first]})
+                    collect_duplicate.update({rows[i]: {self.xls_col_cluster: cluster,
+                                                        self.xls_col_canonical: rows[first],
+                                                        self.xls_col_duplicate_type: duplicate_type,
+                                                        self.xls_col_year: records[rows[i]][self.xls_col_year]}})
 
-            _last_col = len(_xls_columns) - 1
-
-            worksheet = oworkbook.add_worksheet(sheet_type)
-            worksheet.freeze_panes(row = 1, col = 0) # Freeze the first row.
-            worksheet.autofilter(first_row = 0, first_col = 0, last_row = 0, last_col = _last_col) # 'A1:H1'
-            worksheet.set_default_row(height = 14.5)
+        collect_duplicate = {item[0]: item[1] for item in sorted(collect_duplicate.items())}
 
-            # Add columns
-            for icol, column in enumerate(_xls_columns):
-                worksheet.write(0, icol, column, styles_title)
+        if self.MERGE_DUPLICATES and canonical:
+            self.merge_duplicates(records, canonical)
 
-            # Add rows
-            if self.TYPE_FILE == self.TYPE_TXT:
-                worksheet.set_column(first_col = 0, last_col = 0, width = 7)  # Column A:A
-                worksheet.set_column(first_col = 1, last_col = 1, width = 33) # Column B:B
-                if sheet_type == self.XLS_SHEET_DUPLICATES:
-                    worksheet.set_column(first_col = 2, last_col = 2, width = 19) # Column C:C
-            else:
-                worksheet.set_column(first_col = 0, last_col = 0, width = 7)  # Column A:A
-                worksheet.set_column(first_col = 1, last_col = 1, width = 30) # Column B:B
-                worksheet.set_column(first_col = 2, last_col = 2, width = 33) # Column C:C
-                worksheet.set_column(first_col = 3, last_col = 3, width = 8)  # Column D:D
-                worksheet.set_column(first_col = 4, last_col = 4, width = 30) # Column E:E
-                worksheet.set_column(first_col = 5, last_col = 5, width = 18) # Column F:F
-                worksheet.set_column(first_col = 6, last_col = 6, width = 12) # Column G:G
-                worksheet.set_column(first_col = 7, last_col = 7, width = 11) # Column H:H
-                worksheet.set_column(first_col = 8, last_col = 8, width = 18) # Column I:I
-                if sheet_type == self.XLS_SHEET_DUPLICATES:
-                    worksheet.set_column(first_col = 9, last_col = 9, width = 17) # Column J:J
-
-            icol = 0
-            for irow, (index, item) in enumerate(dictionary.items(), start = 1):
-                col_doi = item[self.xls_col_doi]
-                if sheet_type == self.XLS_SHEET_DUPLICATES:
-                    duplicate_type = item[self.xls_col_duplicate_type]
+        collect_papers = {self.XLS_SHEET_UNIQUE: collect_unique,
+                          self.XLS_SHEET_WITHOUT_DOI: collect_without_doi,
+                          self.XLS_SHEET_DUPLICATES: collect_duplicate}
 
-                if self.TYPE_FILE == self.TYPE_TXT:
-                    worksheet.write(irow, icol + 0, index, styles_rows)
-                    worksheet.write(irow, icol + 1, col_doi, styles_rows)
-                    if sheet_type == self.XLS_SHEET_DUPLICATES:
-                        worksheet.write(irow, icol + 2, duplicate_type, styles_rows)
-                else:
-                    worksheet.write(irow, icol + 0, index, styles_rows)
-                    worksheet.write(irow, icol + 1, item[self.xls_col_title], styles_rows)
-                    worksheet.write(irow, icol + 2, item[self.xls_col_abstract], styles_rows)
-                    worksheet.write(irow, icol + 3, item[self.xls_col_year], styles_rows)
-                    worksheet.write(irow, icol + 4, col_doi, styles_rows)
-                    worksheet.write(irow, icol + 5, item[self.xls_col_document_type], styles_rows)
-                    worksheet.write(irow, icol + 6, item[self.xls_col_language], styles_rows)
-                    worksheet.write(irow, icol + 7, item[self.xls_col_cited_by], styles_rows)
-                    worksheet.write(irow, icol + 8, item[self.xls_col_authors], styles_rows)
-                    if sheet_type == self.XLS_SHEET_DUPLICATES:
-                        worksheet.write(irow, icol + 9, duplicate_type, styles_rows)
-
-        workbook = xlsxwriter.Workbook(self.XLS_FILE)
+        return collect_papers
 
-        # Styles
+    def merge_duplicates(self, records, canonical):
+        # Builds one record per group of duplicates: the first record of the
+        # group (the one in the 'Unique' sheet) receives the coalesced fields.
+        # records: {row: record}, canonical: {duplicate row: canonical row}
+        def get_group(row):
+            while row in canonical:
+                row = canonical[row]
+            return row
+
+        # Canonical records go first, so that they win the ties
+        rows = sorted(set(canonical.keys()) | set(canonical.values()), key = lambda row: (row in canonical, row))
+        groups = [get_group(row) for row in rows]
+        columns = [column for column in self.MERGE_RULES if column in records[rows[0]]]
+        df = pd.DataFrame.from_records([[records[row][column] for column in columns] for row in rows], columns = columns)
+        df = df.replace({'': None})
+        group = pd.Series(groups, name = 'group')
+
+        for column in columns:
+            rule = self.MERGE_RULES[column]
+            values = df[column]
+            if rule == self.MERGE_FIRST_NON_EMPTY:
+                merged = values.groupby(group, sort = False).first()
+            elif rule == self.MERGE_LONGEST:
+                length = values.fillna('').astype(str).str.len()
+                longest = length.groupby(group, sort = False).idxmax()
+                merged = pd.Series(values.loc[longest].values, index = longest.index)
+            elif rule == self.MERGE_MAX:
+                merged = pd.to_numeric(values, errors = 'coerce').groupby(group, sort = False).max()
+            else: # self.MERGE_FIRST
+                continue
+
+            for row, value in merged.dropna().items():
+                if isinstance(value, float) and value.is_integer():
+                    value = int(value)
+                records[row][column] = value
+
+        if self.PARSE_AUTHORS:
+            # The parsed authors follow the merged author field
+            parsed = {records[row][self.xls_col_authors]: (records[row][self.xls_col_first_author], records[row][self.xls_col_author_list]) for row in rows}
+            for row in set(groups):
+                records[row][self.xls_col_first_author], records[row][self.xls_col_author_list] = parsed.get(records[row][self.xls_col_authors], (None, None))
+
+        self.show_print("  Merged groups of duplicates: %s" % len(set(groups)), [self.LOG_FILE])
+
+    def create_sheet(self, oworkbook, sheet_name, sheet_type, dictionary, styles_title, styles_rows):
+        worksheet, _xls_columns = self.add_sheet(oworkbook, sheet_name, sheet_type, styles_title)
+        for irow, (index, item) in enumerate(dictionary.items(), start = 1):
+            self.write_row(worksheet, _xls_columns, sheet_type, irow, index, item, styles_rows)
+            self.PROGRESS_COUNT += 1
+
+    def get_output_columns(self):
+        # Every column that the sheets of a source can have
+        return self.xls_columns_csv + [self.xls_col_row,
+                                       self.xls_col_cluster,
+                                       self.xls_col_canonical,
+                                       self.xls_col_duplicate_type,
+                                       self.xls_col_previously_seen,
+                                       self.xls_col_repaired,
+                                       self.xls_col_first_author,
+                                       self.xls_col_author_list]
+
+    def is_compact(self, sheet_type):
+        # Duplicates of clusters are references to their canonical record
+        return self.TYPE_FILE != self.TYPE_TXT and self.DEDUP == self.DEDUP_CLUSTER and sheet_type == self.XLS_SHEET_DUPLICATES
+
+    def add_sheet(self, oworkbook, sheet_name, sheet_type, styles_title):
+        compact = self.is_compact(sheet_type)
+
+        if self.TYPE_FILE == self.TYPE_TXT:
+            _xls_columns = self.xls_columns_txt.copy()
+        elif compact:
+            _xls_columns = self.xls_columns_compact.copy()
+        else:
+            _xls_columns = self.xls_columns_csv + self.EXTRA_COLUMNS
+            if self.PARSE_AUTHORS:
+                _xls_columns.extend([self.xls_col_first_author, self.xls_col_author_list])
+            if self.DEDUP == self.DEDUP_CLUSTER:
+                _xls_columns.extend([self.xls_col_row, self.xls_col_cluster])
+            elif self.ABSTRACTS != self.ABSTRACTS_INLINE:
+                _xls_columns.append(self.xls_col_row) # Key of the abstracts file
+            if self.CORPUS_FILE:
+                _xls_columns.append(self.xls_col_previously_seen)
+            if self.REPAIR_ROWS:
+                _xls_columns.append(self.xls_col_repaired)
+
+        if sheet_type == self.XLS_SHEET_DUPLICATES and not compact:
+            _xls_columns.append(self.xls_col_duplicate_type)
+
+        _last_col = len(_xls_columns) - 1
+
+        worksheet = oworkbook.add_worksheet(sheet_name)
+        worksheet.freeze_panes(row = 1, col = 0) # Freeze the first row.
+        worksheet.autofilter(first_row = 0, first_col = 0, last_row = 0, last_col = _last_col) # 'A1:H1'
+        worksheet.set_default_row(height = 14.5)
+
+        # Add columns
+        for icol, column in enumerate(_xls_columns):
+            worksheet.write(0, icol, column, styles_title)
+
+        # Add rows
+        if self.TYPE_FILE == self.TYPE_TXT:
+            worksheet.set_column(first_col = 0, last_col = 0, width = 7)  # Column A:A
+            worksheet.set_column(first_col = 1, last_col = 1, width = 33) # Column B:B
+            if sheet_type == self.XLS_SHEET_DUPLICATES:
+                worksheet.set_column(first_col = 2, last_col = 2, width = 19) # Column C:C
+        elif compact:
+            worksheet.set_column(first_col = 0, last_col = 0, width = 7)  # Column A:A
+            worksheet.set_column(first_col = 1, last_col = 1, width = 9)  # Column B:B
+            worksheet.set_column(first_col = 2, last_col = 2, width = 15) # Column C:C
+            worksheet.set_column(first_col = 3, last_col = 3, width = 17) # Column D:D
+        else:
+            worksheet.set_column(first_col = 0, last_col = 0, width = 7)  # Column A:A
+            worksheet.set_column(first_col = 1, last_col = 1, width = 30) # Column B:B
+            worksheet.set_column(first_col = 2, last_col = 2, width = 33) # Column C:C
+            worksheet.set_column(first_col = 3, last_col = 3, width = 8)  # Column D:D
+            worksheet.set_column(first_col = 4, last_col = 4, width = 30) # Column E:E
+            worksheet.set_column(first_col = 5, last_col = 5, width = 18) # Column F:F
+            worksheet.set_column(first_col = 6, last_col = 6, width = 12) # Column G:G
+            worksheet.set_column(first_col = 7, last_col = 7, width = 11) # Column H:H
+            worksheet.set_column(first_col = 8, last_col = 8, width = 18) # Column I:I
+            for jcol, column in enumerate(_xls_columns[9:], start = 9):
+                width = 10
+                if column in [self.xls_col_duplicate_type, self.xls_col_previously_seen, self.xls_col_repaired]:
+                    width = 17
+                elif column in self.EXTRA_COLUMNS:
+                    width = 20
+                elif column == self.xls_col_first_author:
+                    width = 18
+                elif column == self.xls_col_author_list:
+                    width = 30
+                worksheet.set_column(first_col = jcol, last_col = jcol, width = width)
+
+        return worksheet, _xls_columns
+
+    def write_row(self, worksheet, _xls_columns, sheet_type, irow, index, item, styles_rows):
+        icol = 0
+        if sheet_type == self.XLS_SHEET_DUPLICATES:
+            duplicate_type = item[self.xls_col_duplicate_type]
+
+        if self.TYPE_FILE == self.TYPE_TXT:
+            worksheet.write(irow, icol + 0, index, styles_rows)
+            worksheet.write(irow, icol + 1, item[self.xls_col_doi], styles_rows)
+            if sheet_type == self.XLS_SHEET_DUPLICATES:
+                worksheet.write(irow, icol + 2, duplicate_type, styles_rows)
+        elif self.is_compact(sheet_type):
+            worksheet.write(irow, icol + 0, index, styles_rows)
+            worksheet.write(irow, icol + 1, item[self.xls_col_cluster], styles_rows)
+            worksheet.write(irow, icol + 2, item[self.xls_col_canonical], styles_rows)
+            worksheet.write(irow, icol + 3, duplicate_type, styles_rows)
+        else:
+            col_doi = item[self.xls_col_doi]
+            worksheet.write(irow, icol + 0, index, styles_rows)
+            worksheet.write(irow, icol + 1, item[self.xls_col_title], styles_rows)
+            if self.ABSTRACTS == self.ABSTRACTS_INLINE:
+                worksheet.write(irow, icol + 2, item[self.xls_col_abstract], styles_rows)
+            elif self.ABSTRACTS == self.ABSTRACTS_SNIPPET:
+                worksheet.write(irow, icol + 2, self.get_snippet(item[self.xls_col_abstract]), styles_rows)
+            worksheet.write(irow, icol + 3, item[self.xls_col_year], styles_rows)
+            worksheet.write(irow, icol + 4, col_doi, styles_rows)
+            worksheet.write(irow, icol + 5, item[self.xls_col_document_type], styles_rows)
+            worksheet.write(irow, icol + 6, item[self.xls_col_language], styles_rows)
+            worksheet.write(irow, icol + 7, item[self.xls_col_cited_by], styles_rows)
+            worksheet.write(irow, icol + 8, item[self.xls_col_authors], styles_rows)
+            for jcol, column in enumerate(_xls_columns[9:], start = 9):
+                worksheet.write(irow, icol + jcol, item.get(column), styles_rows)
+
+    def get_snippet(self, text):
+        snippet = text
+        if text and len(text) > self.ABSTRACT_SNIPPET_LENGTH:
+            snippet = "%s..." % text[:self.ABSTRACT_SNIPPET_LENGTH].rstrip()
+        return snippet
+
+    def save_abstracts(self, sheets):
+        # Every abstract is written once, keyed by the row of the record in the input file
+        abstracts = {}
+        for sheet_type, dictionary in sheets:
+            for item in dictionary.values():
+                row = item.get(self.xls_col_row)
+                abstract = item.get(self.xls_col_abstract)
+                if row is not None and abstract:
+                    abstracts.update({row: abstract})
+
+        with gzip.open(self.ABSTRACTS_FILE, 'wt', encoding = 'utf-8') as fw:
+            for row in sorted(abstracts):
+                fw.write("%s\n" % json.dumps({'row': row, 'abstract': abstracts[row]}, ensure_ascii = False))
+
+        return len(abstracts)
+
+    def get_styles(self, workbook):
         cell_format_title = workbook.add_format({'bold': True,
                                                  'font_color': 'white',
                                                  'bg_color': 'black',
                                                  'align': 'center',
                                                  'valign': 'vcenter'})
         cell_format_row = workbook.add_format({'text_wrap': True, 'valign': 'top'})
+        return cell_format_title, cell_format_row
 
-        create_sheet(workbook, self.XLS_SHEET_UNIQUE, data_paper[self.XLS_SHEET_UNIQUE], cell_format_title, cell_format_row)
-        if self.TYPE_FILE != self.TYPE_TXT:
-            create_sheet(workbook, self.XLS_SHEET_WITHOUT_DOI, data_paper[self.XLS_SHEET_WITHOUT_DOI], cell_format_title, cell_format_row)
-        create_sheet(workbook, self.XLS_SHEET_DUPLICATES, data_paper[self.XLS_SHEET_DUPLICATES], cell_format_title, cell_format_row)
+    def write_workbook(self, xls_file, worksheets):
+        workbook = xlsxwriter.Workbook(xls_file)
 
-        bad_lines = data_paper['bad']
+        # Styles
+        cell_format_title, cell_format_row = self.get_styles(workbook)
+
+        for sheet_name, sheet_type, dictionary in worksheets:
+            self.create_sheet(workbook, sheet_name, sheet_type, dictionary, cell_format_title, cell_format_row)
+
+        workbook.close()
+
+        return xls_file
+
+    def split_rows(self, dictionary, n_rows):
+        items = list(dictionary.items())
+        chunks = [dict(items[i:i + n_rows]) for i in range(0, len(items), n_rows)]
+        return chunks if chunks else [{}]
+
+    def get_shards(self, sheets):
+        # Returns the workbooks to write: [(xls_file, [(sheet_type, dictionary), ...]), ...]
+        xls_name, xls_extension = os.path.splitext(self.XLS_FILE)
+        if self.SHARD_BY == self.SHARD_BY_YEAR:
+            years = {}
+            for sheet_type, dictionary in sheets:
+                for index, item in dictionary.items():
+                    year = item.get(self.xls_col_year)
+                    year = year if year else self.SHARD_UNKNOWN
+                    years.setdefault(year, {_sheet_type: {} for _sheet_type, _ in sheets})
+                    years[year][sheet_type].update({index: item})
+
+            _years = sorted([year for year in years if year != self.SHARD_UNKNOWN])
+            if self.SHARD_UNKNOWN in years:
+                _years.append(self.SHARD_UNKNOWN)
+            shards = [("%s_%s%s" % (xls_name, year, xls_extension), [(sheet_type, years[year][sheet_type]) for sheet_type, _ in sheets]) for year in _years]
+        elif self.SHARD_ROWS:
+            chunks = [(sheet_type, self.split_rows(dictionary, self.SHARD_ROWS)) for sheet_type, dictionary in sheets]
+            n_shards = max([len(_chunks) for _, _chunks in chunks])
+            if n_shards == 1:
+                shards = [(self.XLS_FILE, sheets)]
+            else:
+                shards = [("%s_%s%s" % (xls_name, i + 1, xls_extension), [(sheet_type, _chunks[i] if i < len(_chunks) else {}) for sheet_type, _chunks in chunks]) for i in range(n_shards)]
+        else:
+            shards = [(self.XLS_FILE, sheets)]
+
+        return shards
+
+    def save_summary_xls(self, data_paper):
+        if self.TYPE_FILE == self.TYPE_TXT:
+            return self.save_stream_xls(data_paper, [self.XLS_SHEET_UNIQUE, self.XLS_SHEET_DUPLICATES], {'strings_to_urls': False})
+        if self.STREAM_RECORDS in data_paper:
+            return self.save_stream_xls(data_paper, [self.XLS_SHEET_UNIQUE, self.XLS_SHEET_WITHOUT_DOI, self.XLS_SHEET_DUPLICATES])
+
+        sheets = [(self.XLS_SHEET_UNIQUE, data_paper[self.XLS_SHEET_UNIQUE]),
+                  (self.XLS_SHEET_WITHOUT_DOI, data_paper[self.XLS_SHEET_WITHOUT_DOI]),
+                  (self.XLS_SHEET_DUPLICATES, data_paper[self.XLS_SHEET_DUPLICATES])]
+        data_paper.update({self.COUNTS: {sheet_type: len(dictionary) for sheet_type, dictionary in sheets}})
+
+        if self.ABSTRACTS != self.ABSTRACTS_INLINE:
+            self.save_abstracts(sheets)
+
+        # Sheets bigger than the row limit of Excel continue in 'Sheet (2)', 'Sheet (3)', ...
+        workbooks = []
+        index_rows = []
+        for xls_file, _sheets in self.get_shards(sheets):
+            worksheets = []
+            for sheet_type, dictionary in _sheets:
+                for i, chunk in enumerate(self.split_rows(dictionary, self.XLS_MAX_ROWS - 1), start = 1):
+                    sheet_name = sheet_type if i == 1 else "%s (%s)" % (sheet_type, i)
+                    worksheets.append((sheet_name, sheet_type, chunk))
+                    if chunk:
+                        index_rows.append([os.path.basename(xls_file), sheet_name, next(iter(chunk)), next(reversed(chunk)), len(chunk)])
+            workbooks.append((xls_file, worksheets))
+
+        self.progress_start(self.STAGE_WRITING, 'rows', total = sum([len(dictionary) for _, dictionary in sheets]))
+        if len(workbooks) == 1:
+            self.write_workbook(*workbooks[0])
+        else:
+            # Separate workbooks are written concurrently, the progress is
+            # counted when each one is done
+            with concurrent.futures.ProcessPoolExecutor(max_workers = min(self.JOBS, len(workbooks))) as executor:
+                futures = {executor.submit(self.write_workbook, xls_file, worksheets): sum([len(chunk) for _, _, chunk in worksheets]) for xls_file, worksheets in workbooks}
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+                    self.PROGRESS_COUNT += futures[future]
+        self.progress_stop()
+
+        n_worksheets = sum([len(worksheets) for _, worksheets in workbooks])
+        self.save_index(index_rows, len(workbooks) > 1 or n_worksheets > len(sheets))
+        self.save_bad_lines(data_paper['bad'])
+
+        return [xls_file for xls_file, _ in workbooks]
+
+    def save_stream_xls(self, data_paper, sheet_types, options = None):
+        # The records of the DOI lists and of --pipeline are written as they
+        # are read, xlsxwriter flushes each row in the constant memory mode
+        # (the lines of the DOI lists stay as text, Excel limits the links per
+        # sheet). Sheets bigger than the row limit of Excel continue in
+        # 'Sheet (2)', 'Sheet (3)', ...
+        workbook = xlsxwriter.Workbook(self.XLS_FILE, dict(options or {}, constant_memory = True))
+        cell_format_title, cell_format_row = self.get_styles(workbook)
+
+        def add_sheet(sheet_type, number):
+            sheet_name = sheet_type if number == 1 else "%s (%s)" % (sheet_type, number)
+            worksheet, _xls_columns = self.add_sheet(workbook, sheet_name, sheet_type, cell_format_title)
+            return {'worksheet': worksheet, 'columns': _xls_columns, 'name': sheet_name, 'number': number, 'first': None, 'last': None, 'rows': 0}
+
+        def index_row(sheet):
+            return [os.path.basename(self.XLS_FILE), sheet['name'], sheet['first'], sheet['last'], sheet['rows']]
+
+        current = {sheet_type: add_sheet(sheet_type, 1) for sheet_type in sheet_types}
+        counts = {sheet_type: 0 for sheet_type in sheet_types}
+        index_rows = []
+        self.progress_start(self.STAGE_READING, 'MB', poll = self.poll_input)
+        for sheet_type, index, item in data_paper[self.STREAM_RECORDS]:
+            sheet = current[sheet_type]
+            if sheet['rows'] == self.XLS_MAX_ROWS - 1:
+                index_rows.append(index_row(sheet))
+                sheet = add_sheet(sheet_type, sheet['number'] + 1)
+                current.update({sheet_type: sheet})
+
+            sheet['rows'] += 1
+            sheet['first'] = index if sheet['first'] is None else sheet['first']
+            sheet['last'] = index
+            self.write_row(sheet['worksheet'], sheet['columns'], sheet_type, sheet['rows'], index, item, cell_format_row)
+            counts[sheet_type] += 1
+
+        self.progress_stop()
+        workbook.close()
+
+        index_rows.extend([index_row(current[sheet_type]) for sheet_type in sheet_types if current[sheet_type]['rows']])
+        n_worksheets = sum([sheet['number'] for sheet in current.values()])
+        self.save_index(index_rows, n_worksheets > len(sheet_types))
+        self.save_bad_lines(data_paper['bad'])
+        data_paper.update({self.COUNTS: counts})
+
+        return [self.XLS_FILE]
+
+    def save_index(self, index_rows, save):
+        if save:
+            with open(self.XLS_INDEX_FILE, 'w', encoding = 'utf-8', newline = '') as fw:
+                writer = csv.writer(fw)
+                writer.writerow(self.xls_index_columns)
+                writer.writerows(index_rows)
+        else:
+            if os.path.exists(self.XLS_INDEX_FILE):
+                os.remove(self.XLS_INDEX_FILE)
+
+    def save_bad_lines(self, bad_lines):
         if bad_lines:
             with open(self.TXT_BAD_FILE, 'w') as fw:
                 for line in bad_lines:
@@ -930,7 +3480,132 @@ class FormatInput:
             if os.path.exists(self.TXT_BAD_FILE):
                 os.remove(self.TXT_BAD_FILE)
 
-        workbook.close()
+    def run_benchmark(self):
+        # Runs the source on synthetic inputs of BENCHMARK_STEPS sizes and fits
+        # the exponent k of the time of each stage, t ~ n^k (log-log least
+        # squares). Returns the stages that grow faster than n log n by more
+        # than BENCHMARK_TOLERANCE
+        sizes = [self.BENCHMARK // self.BENCHMARK_FACTOR ** step for step in reversed(range(self.BENCHMARK_STEPS))]
+        times = {}
+        outputs = (self.XLS_FILE, self.TXT_BAD_FILE, self.XLS_INDEX_FILE, self.ABSTRACTS_FILE)
+        with tempfile.TemporaryDirectory(prefix = 'format_input_benchmark_') as directory:
+            # The outputs of the runs are written in the temporary directory too
+            self.XLS_FILE, self.TXT_BAD_FILE, self.XLS_INDEX_FILE, self.ABSTRACTS_FILE = [os.path.join(directory, os.path.basename(file)) for file in outputs]
+            for n in sizes:
+                self.INPUT_FILE = self.write_synthetic_input(directory, n)
+                self.STAGE_TIMES = {}
+                self.TITLE_KEYS = None
+                if self.TYPE_FILE == self.TYPE_TXT:
+                    collect_papers = self.read_txt_file()
+                else:
+                    collect_papers = self.read_csv_file()
+                self.save_summary_xls(collect_papers)
+                self.progress_stop()
+                collect_papers = None
+                os.remove(self.INPUT_FILE)
+
+                for stage, seconds in self.STAGE_TIMES.items():
+                    times.setdefault(stage, {}).update({n: seconds})
+                self.show_print("  %s records: %s" % (n, ', '.join(["%s %.2fs" % (stage, seconds) for stage, seconds in self.STAGE_TIMES.items()])), [self.LOG_FILE])
+            self.XLS_FILE, self.TXT_BAD_FILE, self.XLS_INDEX_FILE, self.ABSTRACTS_FILE = outputs
+        self.show_print("", [self.LOG_FILE])
+
+        log_sizes = np.log(sizes)
+        reference = np.polyfit(log_sizes, np.log(sizes * log_sizes), 1)[0]
+        flagged = []
+        self.show_print("Scaling exponents (n log n: %.2f):" % reference, [self.LOG_FILE], font = self.GREEN)
+        for stage, values in times.items():
+            seconds = [values.get(n, 0) for n in sizes]
+            if max(seconds) < self.BENCHMARK_MIN_SECONDS:
+                self.show_print("  %s: too fast to fit (%.2fs)" % (stage, max(seconds)), [self.LOG_FILE])
+                continue
+            exponent = np.polyfit(log_sizes, np.log(np.maximum(seconds, 1e-3)), 1)[0]
+            if exponent > reference + self.BENCHMARK_TOLERANCE:
+                flagged.append(stage)
+                self.show_print("  %s: %.2f, grows faster than n log n" % (stage, exponent), [self.LOG_FILE], font = self.YELLOW)
+            else:
+                self.show_print("  %s: %.2f" % (stage, exponent), [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
+
+        return flagged
+
+    def iter_synthetic_records(self, n):
+        # (title id, DOI id) of n synthetic records. Every BENCHMARK_CYCLE
+        # records: one without DOI, a duplicate of the previous record, a
+        # record with a new DOI and the previous title, and a duplicate of a
+        # record one cycle back
+        for k in range(n):
+            title_id = k
+            doi_id = k
+            position = k % self.BENCHMARK_CYCLE
+            if position == 0:
+                doi_id = None
+            elif position == 3:
+                title_id = doi_id = k - 1
+            elif position == 5:
+                title_id = k - 1
+            elif position == 7 and k >= self.BENCHMARK_CYCLE:
+                title_id = doi_id = k - self.BENCHMARK_CYCLE + 1
+            yield title_id, doi_id
+
+    def get_synthetic_doi(self, doi_id):
+        return "10.5555/benchmark.%s" % doi_id if doi_id is not None else ''
+
+    def write_synthetic_input(self, directory, n):
+        # Input file of n synthetic records in the format of the source
+        file = os.path.join(directory, "synthetic_%s" % n)
+        records = self.iter_synthetic_records(n)
+        if self.TYPE_FILE == self.TYPE_TXT:
+            with open(file, 'w', encoding = 'utf-8') as fw:
+                for _, doi_id in records:
+                    if doi_id is not None:
+                        fw.write("%s\n" % self.get_synthetic_doi(doi_id))
+        elif self.TYPE_FILE == self.TYPE_SCIENCEDIRECT:
+            fields = self.get_ris_fields()
+            with open(file, 'w', encoding = 'utf-8') as fw:
+                for title_id, doi_id in records:
+                    values = {self.xls_col_authors: "Author %s, A." % title_id,
+                              self.xls_col_title: "Benchmark record %s" % title_id,
+                              self.xls_col_abstract: "Abstract of the benchmark record %s" % title_id,
+                              self.xls_col_year: str(1990 + title_id % 30),
+                              self.xls_col_doi: self.get_synthetic_doi(doi_id)}
+                    fw.write("%s  - JOUR\n" % self.RIS_TAG_TYPE)
+                    for field, value in values.items():
+                        if fields.get(field) and value:
+                            fw.write("%s  - %s\n" % (fields[field][0], value))
+                    fw.write("%s  - \n\n" % self.RIS_TAG_END)
+        elif self.TYPE_FILE == self.TYPE_PUBMED_CENTRAL:
+            with open(file, 'w', encoding = 'utf-8') as fw:
+                for k, (title_id, doi_id) in enumerate(records):
+                    doi = " doi:%s." % self.get_synthetic_doi(doi_id) if doi_id is not None else ''
+                    fw.write("%s PMC%s\n" % (self.START_PMC, k))
+                    fw.write("%s %s\n" % (self.START_PMID, k))
+                    fw.write("%s %s0101\n" % (self.START_DATE, 1990 + title_id % 30))
+                    fw.write("%s Benchmark record %s\n" % (self.START_TITLE, title_id))
+                    fw.write("%s eng\n" % self.START_LANGUAGE)
+                    fw.write("%s Journal Article\n" % self.START_PUBLICATION_TYPE)
+                    fw.write("%s Journal\n" % self.START_JOURNAL_TYPE)
+                    fw.write("%s Author %s, A.\n" % (self.START_AUTHOR, title_id))
+                    fw.write("%s Abstract of the benchmark record %s\n" % (self.START_ABSTRACT, title_id))
+                    fw.write("%s J. %s;%s\n\n" % (self.START_DOI, 1990 + title_id % 30, doi))
+        else:
+            # The columns of the source, the text ones take the name of the
+            # column and the title id
+            source = self.get_csv_columns()
+            columns = source['required'] + self.EXTRA_COLUMNS + source['doi_fallback']
+            numbers = [source['year'], source['cited_by']]
+            with open(file, 'w', encoding = 'utf-8', newline = '') as fw:
+                writer = csv.writer(fw, delimiter = source['separator'])
+                writer.writerow(columns)
+                for k, (title_id, doi_id) in enumerate(records):
+                    values = {column: "%s %s" % (column, title_id) for column in source['required'] + self.EXTRA_COLUMNS if column not in numbers}
+                    values.update({column: self.BENCHMARK_CATEGORIES[k % len(self.BENCHMARK_CATEGORIES)] for column in source['category']})
+                    values.update({source['doi']: self.get_synthetic_doi(doi_id),
+                                   source['year']: str(1990 + title_id % 30),
+                                   source['cited_by']: str(k % 100)})
+                    writer.writerow([values.get(column, '') for column in columns])
+
+        return file
 
     def get_language(self, code):
         # https://en.wikipedia.org/wiki/List_of_ISO_639_language_codes
@@ -1385,8 +4060,14 @@ class FormatInput:
                 doc_type = text
             return doc_type
 
+        # Only the columns of the source and the extra ones are converted
+        source = self.get_csv_columns()
+        columns = source['required'] + source['doi_fallback'] + self.EXTRA_COLUMNS
+        its_pmid = 'PMID' in columns
+        its_journal_type = 'Journal Type' in columns
+
         medline_data = {}
-        with open(file, 'r', encoding = 'utf8') as fr:
+        with self.open_input(file) as fr:
             item_dict = {self.param_pmc: None,
                          self.param_pmc_pmid: None,
                          self.param_pmc_date: None,
@@ -1458,9 +4139,11 @@ class FormatInput:
                         continue
 
                     if flag_start:
-                        self.get_data(line, arr_pmid, self.START_PMID)
+                        if its_pmid:
+                            self.get_data(line, arr_pmid, self.START_PMID)
                         self.get_data(line, arr_language, self.START_LANGUAGE)
-                        self.get_data(line, arr_journal_type, self.START_JOURNAL_TYPE)
+                        if its_journal_type:
+                            self.get_data(line, arr_journal_type, self.START_JOURNAL_TYPE)
                         self.get_data(line, arr_publication_type, self.START_PUBLICATION_TYPE)
                         self.get_data(line, arr_date, self.START_DATE)
                         self.get_data(line, arr_author, self.START_AUTHOR)
@@ -1547,6 +4230,18 @@ class FormatInput:
                 _doi = self.remove_endpoint(_doi_raw[1])
             item.update({self.param_pmc_doi: _doi})
 
+        fields = [('PMID', self.param_pmc_pmid),
+                  (self.pmc_col_title, self.param_pmc_title),
+                  (self.pmc_col_authors, self.param_pmc_author),
+                  (self.pmc_col_year, self.param_pmc_date),
+                  ('PMCID', self.param_pmc),
+                  (self.pmc_col_doi, self.param_pmc_doi),
+                  (self.pmc_col_language, self.param_pmc_language),
+                  (self.pmc_col_document_type, self.param_pmc_publication_type),
+                  ('Journal Type', self.param_pmc_journal_type),
+                  (self.pmc_col_abstract, self.param_pmc_abstract)]
+        fields = [(column, param) for column, param in fields if column in columns]
+
         # Temporary file .csv
         fw_tmp = tempfile.NamedTemporaryFile(mode = 'w+t',
                                              encoding = 'utf-8',
@@ -1554,29 +4249,14 @@ class FormatInput:
                                              suffix = '.csv',
                                              delete = False)
 
-        fw_tmp.write('"%s","%s","%s","%s","%s","%s","%s","%s","%s","%s"\n' % ('PMID',
-                                                                              self.pmc_col_title,
-                                                                              self.pmc_col_authors,
-                                                                              self.pmc_col_year,
-                                                                              'PMCID',
-                                                                              self.pmc_col_doi,
-                                                                              self.pmc_col_language,
-                                                                              self.pmc_col_document_type,
-                                                                              'Journal Type',
-                                                                              self.pmc_col_abstract))
-        for _, detail in medline_data.items():
-            fw_tmp.write('"%s","%s","%s","%s","%s","%s","%s","%s","%s","%s"\n' % (detail[self.param_pmc_pmid],
-                                                                                  detail[self.param_pmc_title],
-                                                                                  detail[self.param_pmc_author],
-                                                                                  detail[self.param_pmc_date],
-                                                                                  detail[self.param_pmc],
-                                                                                  detail[self.param_pmc_doi],
-                                                                                  detail[self.param_pmc_language],
-                                                                                  detail[self.param_pmc_publication_type],
-                                                                                  detail[self.param_pmc_journal_type],
-                                                                                  detail[self.param_pmc_abstract]))
-        fw_tmp.seek(0)
-        # fw_tmp.close()
+        try:
+            with fw_tmp:
+                fw_tmp.write('%s\n' % ','.join(['"%s"' % column for column, _ in fields]))
+                for _, detail in medline_data.items():
+                    fw_tmp.write('%s\n' % ','.join(['"%s"' % detail[param] for _, param in fields]))
+        except BaseException:
+            os.remove(fw_tmp.name)
+            raise
 
         return fw_tmp.name
 
@@ -1589,17 +4269,18 @@ class FormatInput:
                                              suffix = '.csv',
                                              delete = False)
 
-        flag_index = 0
-        with open(file, 'r', encoding = 'utf-8') as fr:
-            for index, line in enumerate(fr):
-                if 'SEARCH QUERY' in line:
-                    flag_index = 3
-
-                if index >= flag_index:
-                    fw_tmp.write(line)
-        fr.close()
-        fw_tmp.seek(0)
-        # fw_tmp.close()
+        try:
+            flag_index = 0
+            with fw_tmp, self.open_input(file) as fr:
+                for index, line in enumerate(fr):
+                    if 'SEARCH QUERY' in line:
+                        flag_index = 3
+
+                    if index >= flag_index:
+                        fw_tmp.write(line)
+        except BaseException:
+            os.remove(fw_tmp.name)
+            raise
 
         return fw_tmp.name
 
@@ -1612,104 +4293,18 @@ class FormatInput:
                                              suffix = '.csv',
                                              delete = False)
 
-        with open(file, 'r', encoding = 'utf-8') as fr:
-            for line in fr:
-                flag_save = True
-                if 'About the data: Exported on' in line and 'Criteria:' in line:
-                    flag_save = False
-
-                if flag_save:
-                    fw_tmp.write(line)
-        fr.close()
-        fw_tmp.seek(0)
-        # fw_tmp.close()
-
-        return fw_tmp.name
-
-    def read_sciencedirect_file(self, file):
-        sciencedirect_data = []
-        current_record = {}
-        authors = []
-        keywords = []
-
-        with open(file, 'r', encoding = 'utf-8') as fr:
-            for line in fr:
-                line = line.strip()
-                if not line:
-                    continue
-
-                if line.startswith('TY  -'):
-                    if current_record:
-                        current_record[self.param_sciencedirect_authors] = '; '.join(authors)
-                        current_record[self.param_sciencedirect_keywords] = '; '.join(keywords)
-                        sciencedirect_data.append(current_record)
-
-                    current_record = {'TY': line.split('- ')[1].strip()}
-                    authors = []
-                    keywords = []
-                elif line.startswith('AU  -'):
-                    arr_line = line.split('- ')
-                    if len(arr_line) > 1:
-                        author = arr_line[1].strip()
-                        authors.append(author)
-                elif line.startswith('KW  -'):
-                    arr_line = line.split('- ')
-                    if len(arr_line) > 1:
-                        keyword = arr_line[1].strip()
-                        keywords.append(keyword)
-                else:
-                    key_value = line.split('- ', 1)
-                    if len(key_value) == 2:
-                        key, value = key_value
-                        key = key.strip()
-                        value = value.strip()
-                        current_record[key] = value
-
-        if current_record:
-            current_record[self.param_sciencedirect_authors] = '; '.join(authors)
-            current_record[self.param_sciencedirect_keywords] = '; '.join(keywords)
-            sciencedirect_data.append(current_record)
-
-        fw_tmp = tempfile.NamedTemporaryFile(mode = 'w+t',
-                                             encoding = 'utf-8',
-                                             prefix = 'sciencedirect_output_',
-                                             suffix = '.csv',
-                                             delete = False)
-
-        headers = [self.param_sciencedirect_title,
-                   self.param_sciencedirect_authors,
-                   self.param_sciencedirect_journal,
-                   self.param_sciencedirect_publication_year,
-                   self.param_sciencedirect_volume,
-                   self.param_sciencedirect_first_page,
-                   self.param_sciencedirect_last_page,
-                   self.param_sciencedirect_publication_date,
-                   self.param_sciencedirect_issn,
-                   self.param_sciencedirect_abstract,
-                   self.param_sciencedirect_keywords,
-                   self.param_sciencedirect_doi,
-                   self.param_sciencedirect_sciencedirect_link]
-
-        fw_tmp.write('"' + '"|"'.join(headers) + '"\n')
-
-        for record in sciencedirect_data:
-            row = [record.get(self.param_sciencedirect_title, '').replace('“', '').replace('”', ''),
-                   record.get(self.param_sciencedirect_authors, ''),
-                   record.get(self.param_sciencedirect_journal, ''),
-                   record.get(self.param_sciencedirect_publication_year, ''),
-                   record.get(self.param_sciencedirect_volume, ''),
-                   record.get(self.param_sciencedirect_first_page, ''),
-                   record.get(self.param_sciencedirect_last_page, ''),
-                   record.get(self.param_sciencedirect_publication_date, ''),
-                   record.get(self.param_sciencedirect_issn, ''),
-                   record.get(self.param_sciencedirect_abstract, '').replace('"', ''),
-                   record.get(self.param_sciencedirect_keywords, ''),
-                   record.get(self.param_sciencedirect_doi, '').replace('https://doi.org/', ''),
-                   record.get(self.param_sciencedirect_sciencedirect_link, '')]
-
-            fw_tmp.write('"' + '"|"'.join(row) + '"\n')
-
-        fw_tmp.seek(0)
+        try:
+            with fw_tmp, self.open_input(file) as fr:
+                for line in fr:
+                    flag_save = True
+                    if 'About the data: Exported on' in line and 'Criteria:' in line:
+                        flag_save = False
+
+                    if flag_save:
+                        fw_tmp.write(line)
+        except BaseException:
+            os.remove(fw_tmp.name)
+            raise
 
         return fw_tmp.name
 
@@ -1721,10 +4316,21 @@ def main():
         ofi.LOG_FILE = os.path.join(ofi.OUTPUT_PATH, ofi.LOG_NAME)
         ofi.XLS_FILE = os.path.join(ofi.OUTPUT_PATH, ofi.XLS_FILE.replace('<type>', ofi.TYPE_FILE))
         ofi.TXT_BAD_FILE = os.path.join(ofi.OUTPUT_PATH, ofi.TXT_BAD_FILE.replace('<type>', ofi.TYPE_FILE))
+        ofi.XLS_INDEX_FILE = os.path.join(ofi.OUTPUT_PATH, ofi.XLS_INDEX_FILE.replace('<type>', ofi.TYPE_FILE))
+        ofi.ABSTRACTS_FILE = os.path.join(ofi.OUTPUT_PATH, ofi.ABSTRACTS_FILE.replace('<type>', ofi.TYPE_FILE))
         ofi.show_print("#############################################################################", [ofi.LOG_FILE], font = ofi.BIGREEN)
         ofi.show_print("############################### Format Input ################################", [ofi.LOG_FILE], font = ofi.BIGREEN)
         ofi.show_print("#############################################################################", [ofi.LOG_FILE], font = ofi.BIGREEN)
 
+        if ofi.BENCHMARK:
+            ofi.show_print("Benchmark of '%s' up to %s records" % (ofi.TYPE_FILE, ofi.BENCHMARK), [ofi.LOG_FILE], font = ofi.GREEN)
+            flagged = ofi.run_benchmark()
+            ofi.show_print(ofi.finish_time(start, "Elapsed time"), [ofi.LOG_FILE])
+            ofi.show_print("Done!", [ofi.LOG_FILE])
+            if flagged:
+                exit(1)
+            return
+
         # Read input file
         input_information = {}
         if ofi.TYPE_FILE == ofi.TYPE_TXT:
@@ -1777,30 +4383,52 @@ def main():
         ofi.show_print("Input file: %s" % ofi.INPUT_FILE, [ofi.LOG_FILE])
         ofi.show_print("", [ofi.LOG_FILE])
 
+        xls_files = ofi.save_summary_xls(input_information) # The DOI lists are read while they are written
+        counts = input_information[ofi.COUNTS]
+
         n_bad = len(input_information['bad'])
         if n_bad > 0:
             ofi.show_print("Warning: %s" % ofi.TXT_BAD_FILE, [ofi.LOG_FILE], font = ofi.YELLOW)
             ofi.show_print("  Bad lines: %s" % n_bad, [ofi.LOG_FILE])
             ofi.show_print("", [ofi.LOG_FILE])
 
-        ofi.save_summary_xls(input_information)
-        n_unique = len(input_information[ofi.XLS_SHEET_UNIQUE])
-        n_duplicates = len(input_information[ofi.XLS_SHEET_DUPLICATES])
+        n_unique = counts[ofi.XLS_SHEET_UNIQUE]
+        n_duplicates = counts[ofi.XLS_SHEET_DUPLICATES]
         n_total = n_unique + n_duplicates
-        ofi.show_print("Output file: %s" % ofi.XLS_FILE, [ofi.LOG_FILE], font = ofi.GREEN)
+        if len(xls_files) == 1:
+            ofi.show_print("Output file: %s" % xls_files[0], [ofi.LOG_FILE], font = ofi.GREEN)
+        else:
+            ofi.show_print("Output files: %s workbooks, see the index %s" % (len(xls_files), ofi.XLS_INDEX_FILE), [ofi.LOG_FILE], font = ofi.GREEN)
         ofi.show_print("  Unique documents: %s" % n_unique, [ofi.LOG_FILE])
         ofi.show_print("  Duplicate documents: %s" % n_duplicates, [ofi.LOG_FILE])
         if ofi.TYPE_FILE != ofi.TYPE_TXT:
-            n_without = len(input_information[ofi.XLS_SHEET_WITHOUT_DOI])
+            n_without = counts[ofi.XLS_SHEET_WITHOUT_DOI]
             n_total += n_without
             ofi.show_print("  Documents without DOI: %s" % n_without, [ofi.LOG_FILE])
         ofi.show_print("  [Total: %s]" % n_total, [ofi.LOG_FILE])
+        if ofi.TYPE_FILE != ofi.TYPE_TXT and ofi.ABSTRACTS != ofi.ABSTRACTS_INLINE:
+            ofi.show_print("Abstracts file: %s" % ofi.ABSTRACTS_FILE, [ofi.LOG_FILE], font = ofi.GREEN)
 
         ofi.show_print("", [ofi.LOG_FILE])
+        if ofi.MEMORY_PROFILE:
+            ofi.show_memory_profile()
         ofi.show_print(ofi.finish_time(start, "Elapsed time"), [ofi.LOG_FILE])
         ofi.show_print("Done!", [ofi.LOG_FILE])
+        if ofi.STATUS_FILE:
+            ofi.save_status({'stage': ofi.STAGE_DONE, 'elapsed': round(time.time() - start)})
+        if ofi.METRICS_FILE:
+            ofi.save_metrics(time.time() - start, counts, n_bad)
     except Exception as e:
+        ofi.progress_stop()
         ofi.show_print("\n%s" % traceback.format_exc(), [ofi.LOG_FILE], font = ofi.RED)
+        # The first error is already logged, a failure here can't hide it
+        try:
+            if ofi.STATUS_FILE:
+                ofi.save_status({'stage': ofi.STAGE_FAILED, 'elapsed': round(time.time() - start)})
+            if ofi.METRICS_FILE:
+                ofi.save_metrics(time.time() - start, success = False)
+        except Exception as e_save:
+            ofi.show_print("Couldn't save the status or the metrics of the run: %s" % e_save, [ofi.LOG_FILE], font = ofi.RED)
         ofi.show_print(ofi.finish_time(start, "Elapsed time"), [ofi.LOG_FILE])
         ofi.show_print("Done!", [ofi.LOG_FILE])
 
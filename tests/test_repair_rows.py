@@ -0,0 +1,123 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from format_input import FormatInput
+
+HEADER = b'Authors,Title,Abstract,Year,DOI\n'
+SCOPUS_HEADER = b'Authors,Title,Abstract,Year,DOI,Document Type,Language,Cited by,Source\n'
+
+
+class TestRepairCsvRows(unittest.TestCase):
+
+    def setUp(self):
+        self.ofi = FormatInput()
+        self.shapes = {'Year': self.ofi.CSV_SHAPE_YEAR, 'DOI': self.ofi.CSV_SHAPE_DOI, 'Cited by': self.ofi.CSV_SHAPE_NUMBER}
+
+    def test_unclosed_quote_in_last_record(self):
+        data = b'A,T1,Ab,2001,10.1/a\nSmith J.,"Title unclosed,Abstract 4,2004,10.1/b\n'
+        repaired, bad_records = self.ofi.repair_csv_rows(HEADER, data)
+        self.assertEqual(repaired, b'A,T1,Ab,2001,10.1/a\nSmith J.,Title unclosed,Abstract 4,2004,10.1/b,Unclosed quote\n')
+        self.assertEqual(bad_records, [])
+
+    def test_unclosed_quote_before_last_records(self):
+        data = b'Smith J.,"Title unclosed,Abstract 4,2004,10.1/b\nB,T2,Ab,2002,10.1/c\nC,T3,Ab,2003,10.1/d\n'
+        repaired, bad_records = self.ofi.repair_csv_rows(HEADER, data)
+        self.assertEqual(repaired, b'Smith J.,Title unclosed,Abstract 4,2004,10.1/b,Unclosed quote\nB,T2,Ab,2002,10.1/c\nC,T3,Ab,2003,10.1/d\n')
+        self.assertEqual(bad_records, [])
+
+    def test_unclosed_quote_without_whole_record(self):
+        data = b'Smith J.,"Title, unclosed, Abstract 4\nB,T2,Ab,2002,10.1/c\nC,T3,Ab,2003,10.1/d\n'
+        repaired, bad_records = self.ofi.repair_csv_rows(HEADER, data)
+        self.assertEqual(repaired, b'B,T2,Ab,2002,10.1/c\nC,T3,Ab,2003,10.1/d\n')
+        self.assertEqual(bad_records, [0])
+
+    def test_stray_quote_with_missing_fields(self):
+        data = b'"Smith, J.","Title with unclosed quote,"Abstract 9",2009,10.1000/x9\nB,T2,Ab,2002,10.1/c\n'
+        repaired, bad_records = self.ofi.repair_csv_rows(HEADER, data)
+        self.assertEqual(repaired, b'B,T2,Ab,2002,10.1/c\n')
+        self.assertEqual(bad_records, [0])
+
+    def test_broken_row_before_multiline_record(self):
+        multiline = b'"Doe, A.","Multi\nline title",Abstract,2002,10.1/c,Article,English,2,Scopus\n'
+        data = b'Smith J.,"Broken, only\n' + multiline + b'C,T3,Ab,2003,10.1/d,Article,English,3,Scopus\n'
+        repaired, bad_records = self.ofi.repair_csv_rows(SCOPUS_HEADER, data, shapes = self.shapes)
+        self.assertEqual(repaired, multiline + b'C,T3,Ab,2003,10.1/d,Article,English,3,Scopus\n')
+        self.assertEqual(bad_records, [0])
+
+    def test_unclosed_quote_before_multiline_record(self):
+        multiline = b'"Doe, A.","Multi\nline title",Abstract,2002,10.1/c,Article,English,2,Scopus\n'
+        data = b'Smith J.,"Title unclosed,Abstract 4,2004,10.1/b,Article,English,1,Scopus\n' + multiline
+        repaired, bad_records = self.ofi.repair_csv_rows(SCOPUS_HEADER, data, shapes = self.shapes)
+        self.assertEqual(repaired, b'Smith J.,Title unclosed,Abstract 4,2004,10.1/b,Article,English,1,Scopus,Unclosed quote\n' + multiline)
+        self.assertEqual(bad_records, [])
+
+    def test_stray_quote_in_multiline_record(self):
+        data = b'"Doe, A.","Title "2" of paper,"Abstract, line one\nline two",2002,10.1/c,Article,English,2,Scopus\nC,T3,Ab,2003,10.1/d,Article,English,3,Scopus\n'
+        repaired, bad_records = self.ofi.repair_csv_rows(SCOPUS_HEADER, data, shapes = self.shapes)
+        self.assertEqual(repaired, b'C,T3,Ab,2003,10.1/d,Article,English,3,Scopus\n')
+        self.assertEqual(bad_records, [0, 1])
+
+    def test_extra_fields_in_text_column(self):
+        data = b'Smith J.,Title,Abstract, with comma,2004,10.1/b,Article,English,1,Scopus\n'
+        repaired, bad_records = self.ofi.repair_csv_rows(SCOPUS_HEADER, data, shapes = self.shapes)
+        self.assertEqual(repaired, b'Smith J.,Title,"Abstract, with comma",2004,10.1/b,Article,English,1,Scopus,Extra fields\n')
+        self.assertEqual(bad_records, [])
+
+    def test_trailing_extra_fields(self):
+        data = b'A,T,Ab,2001,10.1/y,Article,English,1,Scopus,extra,7\nB,T2,Ab,2002,10.1/c,Article,English,2,Scopus\n'
+        repaired, bad_records = self.ofi.repair_csv_rows(SCOPUS_HEADER, data, shapes = self.shapes)
+        self.assertEqual(repaired, b'B,T2,Ab,2002,10.1/c,Article,English,2,Scopus\n')
+        self.assertEqual(bad_records, [0])
+
+    def test_extra_fields_shifting_shaped_columns(self):
+        header = b'Authors,Title,Year,DOI,Abstract,Document Type,Language\n'
+        shapes = {'Year': self.ofi.CSV_SHAPE_YEAR, 'DOI': self.ofi.CSV_SHAPE_DOI}
+        repaired, bad_records = self.ofi.repair_csv_rows(header, b'A,T,2001,10.1/y,ab,article,English,1,extra\n', shapes = shapes)
+        self.assertEqual(repaired, b'')
+        self.assertEqual(bad_records, [0])
+
+
+class TestCsvProblemRegions(unittest.TestCase):
+
+    def test_short_records_after_quoting_error(self):
+        # The rest of a multi-line record with a stray quote is in the region
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, 'input.csv')
+            with open(file, 'wb') as fw:
+                fw.write(SCOPUS_HEADER)
+                fw.write(b'A,T1,Ab,2001,10.1/a,Article,English,1,Scopus\n')
+                fw.write(b'"Doe, A.","Title "2" of paper,"Abstract, line one\nline two",2002,10.1/c,Article,English,2,Scopus\n')
+                fw.write(b'C,T3,Ab,2003,10.1/d,Article,English,3,Scopus\n')
+            regions = FormatInput().find_csv_problem_regions(file)[3]
+        self.assertEqual([region[:2] for region in regions], [[3, 4]])
+
+
+class TestReadCsvArrow(unittest.TestCase):
+
+    def test_malformed_file_falls_back(self):
+        # pyarrow folds the records after an unclosed quote in one field
+        # without an error, it must not be asked to parse the file
+        ofi = FormatInput()
+        ofi.ENGINE = ofi.ENGINE_ARROW
+        read_csv = mock.Mock(side_effect = AssertionError('pyarrow parsed a malformed file'))
+        with tempfile.TemporaryDirectory() as directory:
+            file = os.path.join(directory, 'input.csv')
+            with open(file, 'wb') as fw:
+                fw.write(HEADER)
+                fw.write(b'A,T1,Ab,2001,10.1/a\n')
+                fw.write(b'Smith J.,"Title unclosed,Abstract 4,2004,10.1/b\n')
+                fw.write(b'C,T3,Ab,2003,10.1/d\n')
+            with mock.patch('format_input.pyarrow', object()):
+                with mock.patch('format_input.pd.read_csv', read_csv), mock.patch.object(ofi, 'show_print') as show_print:
+                    self.assertIsNone(ofi.read_csv_arrow(file))
+        self.assertIn('malformed', show_print.call_args[0][0])
+        read_csv.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()